@@ -0,0 +1,200 @@
+### Headless HTTP API around GovernmentSchemeRAG
+# Run with several workers behind a load balancer, e.g.
+#   RAG_SNAPSHOT_DIR=snapshot/ uvicorn api:app --workers 4 --port 8000
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, Field
+
+from corpora import CorpusRegistry, load_corpora_config
+from metrics import REGISTRY
+from rag import GovernmentSchemeRAG
+from warmup import EXAMPLE_QUERIES, hot_questions, start_warmer
+
+JSON_PATH = os.getenv("RAG_JSON_PATH", "scheme_data.json")
+SNAPSHOT_DIR = os.getenv("RAG_SNAPSHOT_DIR")
+HF_TOKEN = os.getenv("HUGGINGFACE_TOKEN", "")
+MAX_BATCH_SIZE = int(os.getenv("RAG_MAX_BATCH_SIZE", "32"))
+# FAISS rejects k < 1 and allocates k results per question
+MAX_TOP_K = int(os.getenv("RAG_MAX_TOP_K", "50"))
+WARMUP = os.getenv("RAG_WARMUP", "1") != "0"
+# JSON file naming several corpora (see corpora.py); requests may then pick one
+CORPORA = os.getenv("RAG_CORPORA")
+
+
+class RetrieveRequest(BaseModel):
+    question: str
+    top_k: int = Field(3, ge=1, le=MAX_TOP_K)
+    # One corpus name, several, or ["*"] for all; results are merged by score
+    corpora: Optional[List[str]] = None
+
+
+class AnswerRequest(BaseModel):
+    question: str
+    top_k: int = Field(3, ge=1, le=MAX_TOP_K)
+    corpus: Optional[str] = None
+    ministry: Optional[str] = None
+    priority: int = 0
+    timeout_s: Optional[float] = None
+
+
+class BatchAnswerRequest(BaseModel):
+    questions: List[str]
+    top_k: int = Field(3, ge=1, le=MAX_TOP_K)
+    ministry: Optional[str] = None
+    priority: int = 0
+    timeout_s: Optional[float] = None
+
+
+def load_rag_system():
+    # With a snapshot every worker process maps the same index files
+    if SNAPSHOT_DIR and os.path.isdir(SNAPSHOT_DIR):
+        return GovernmentSchemeRAG(JSON_PATH, HF_TOKEN, snapshot_dir=SNAPSHOT_DIR)
+    return GovernmentSchemeRAG(JSON_PATH, HF_TOKEN)
+
+
+HTTP_REQUESTS = REGISTRY.counter("rag_http_requests_total", "HTTP requests served, by path and status.")
+HTTP_SECONDS = REGISTRY.histogram("rag_http_request_seconds", "HTTP request latency in seconds, by path.")
+
+
+def registry_or_404(request):
+    registry = request.app.state.registry
+    if registry is None:
+        raise HTTPException(status_code=404, detail="No corpora configured; set RAG_CORPORA.")
+    return registry
+
+
+def default_rag(request):
+    # With RAG_CORPORA the default corpus is fetched from the registry on each
+    # request, so it stays in the LRU order and within the memory budget
+    registry = request.app.state.registry
+    return registry.get() if registry is not None else request.app.state.rag
+
+
+def corpus_names(request, corpora):
+    try:
+        return registry_or_404(request).names(corpora)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # With RAG_CORPORA the default corpus plays the single-index role; it is
+    # not held here, or eviction would free the registry's copy but not this one
+    app.state.registry = CorpusRegistry(load_corpora_config(CORPORA), HF_TOKEN) if CORPORA else None
+    app.state.rag = None if CORPORA else load_rag_system()
+    rag = app.state.registry.get() if CORPORA else app.state.rag
+    # Serve immediately while hot questions are warmed in the background
+    warmer = start_warmer(rag, hot_questions(EXAMPLE_QUERIES)) if WARMUP else None
+    del rag
+    yield
+    if warmer is not None:
+        warmer[1].set()
+
+
+app = FastAPI(title="Government Scheme QnA API", lifespan=lifespan)
+
+
+@app.middleware("http")
+async def record_request(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # The route template, not the raw path: ids and scanner paths would
+        # otherwise each add a series that is never freed
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        HTTP_REQUESTS.inc(path=path, status=status)
+        HTTP_SECONDS.observe(time.perf_counter() - start, path=path)
+
+
+# Handlers are plain `def` so FastAPI runs the blocking embedding, FAISS and
+# generation calls in its thread pool instead of on the event loop.
+@app.get("/health")
+def health(request: Request):
+    rag = default_rag(request)
+    state = rag.state
+    watcher = rag.watcher
+    return {"status": "ok", "chunks": len(state.chunks), "vectors": state.index.ntotal, "runtime": rag.runtime,
+            "warmup": getattr(rag, "warmup_stats", None),
+            "index": {"version": state.version, "loaded_at": state.loaded_at,
+                      "watching": watcher is not None, "last_reload_error": watcher.last_error if watcher else None}}
+
+
+@app.get("/corpora")
+def corpora(request: Request):
+    return registry_or_404(request).stats()
+
+
+@app.get("/metadata")
+def metadata(request: Request):
+    state = default_rag(request).state
+    return {"metadata": list(state.metadata), "version": state.version}
+
+
+@app.get("/schemes/{scheme_id}/card")
+def scheme_card(scheme_id: int, request: Request, version: Optional[int] = None):
+    # Scheme ids are positions in one index build; pass the "version" of the
+    # result the id came from so an id kept across a reload is refused
+    rag = default_rag(request)
+    state = rag.state
+    if version is not None and version != state.version:
+        raise HTTPException(status_code=409, detail=f"Scheme id {scheme_id} is from index version {version}; "
+                                                    f"the index is now at version {state.version}.")
+    if not 0 <= scheme_id < len(state.chunks):
+        raise HTTPException(status_code=404, detail=f"Unknown scheme id {scheme_id}.")
+    return {"id": scheme_id, "card": rag.get_card(scheme_id, state), "markdown": rag.render_card(scheme_id, state)}
+
+
+@app.post("/retrieve")
+def retrieve(body: RetrieveRequest, request: Request):
+    if not body.question.strip():
+        raise HTTPException(status_code=400, detail="Question must not be empty.")
+    if body.corpora:
+        names = corpus_names(request, "*" if body.corpora == ["*"] else body.corpora)
+        return {"question": body.question,
+                "results": request.app.state.registry.query(body.question, corpora=names, top_k=body.top_k)}
+    return {"question": body.question, "results": default_rag(request).query(body.question, top_k=body.top_k)}
+
+
+@app.post("/answer")
+def answer(body: AnswerRequest, request: Request):
+    if not body.question.strip():
+        raise HTTPException(status_code=400, detail="Question must not be empty.")
+    if body.corpus:
+        corpus_names(request, body.corpus)
+        return request.app.state.registry.answer(body.question, corpus=body.corpus, top_k=body.top_k,
+                                                 ministry=body.ministry, priority=body.priority,
+                                                 timeout=body.timeout_s)
+    return default_rag(request).answer(body.question, top_k=body.top_k, ministry=body.ministry,
+                                        priority=body.priority, timeout=body.timeout_s)
+
+
+@app.post("/answer/batch")
+def answer_batch(body: BatchAnswerRequest, request: Request):
+    if len(body.questions) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_SIZE} questions per batch.")
+    if any(not q.strip() for q in body.questions):
+        raise HTTPException(status_code=400, detail="Questions must not be empty.")
+    return {"answers": default_rag(request).answer_batch(body.questions, top_k=body.top_k, ministry=body.ministry,
+                                                          priority=body.priority, timeout=body.timeout_s)}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return REGISTRY.render()
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("api:app", host=os.getenv("RAG_API_HOST", "0.0.0.0"), port=int(os.getenv("RAG_API_PORT", "8000")),
+                workers=int(os.getenv("RAG_API_WORKERS", "4")))
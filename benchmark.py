@@ -0,0 +1,388 @@
+### Reproducible benchmarks for ingest, retrieval and end-to-end answers
+# python benchmark.py --sizes 1000,10000 --output bench_results.jsonl
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import numpy as np
+
+from cache import LRUCache
+from encoders import DEFAULT_MODEL, compare_encoders, encode_batched, load_encoder
+from hotswap import IndexState
+from metrics import REGISTRY
+from rag import GovernmentSchemeRAG
+from ratelimit import AdmissionController
+from runtime import set_threads
+from shards import ShardedIndex
+from warmup import warm
+
+MINISTRIES = [
+    "Ministry of Agriculture and Farmers Welfare", "Ministry of Education", "Ministry of Finance",
+    "Ministry of Women and Child Development", "Ministry of Rural Development", "Ministry of Health and Family Welfare",
+    "Ministry of Micro, Small and Medium Enterprises", "Ministry of Social Justice and Empowerment",
+]
+TOPICS = [
+    "farmers", "women entrepreneurs", "girl students", "startups", "senior citizens", "rural households",
+    "persons with disabilities", "artisans", "fishermen", "street vendors", "scheduled castes", "minority students",
+]
+BENEFITS = [
+    "financial assistance of Rs {n},000 per year", "a collateral-free loan of up to Rs {n} lakh",
+    "a scholarship of Rs {n},000", "an interest subsidy of {n}%", "free skill training for {n} months",
+    "health insurance cover of Rs {n} lakh",
+]
+QUESTIONS = [
+    "What schemes are available for {topic}?", "Financial assistance for {topic}?",
+    "Is there an age limit for schemes for {topic}?", "How do {topic} apply for a loan?",
+    "Which ministry supports {topic}?",
+]
+# Hindi questions for sizing the multilingual encoder against the English-only path
+HINDI_QUESTIONS = [
+    "किसानों के लिए कौन सी योजनाएं उपलब्ध हैं?", "महिला उद्यमियों के लिए ऋण योजना कौन सी है?",
+    "छात्राओं के लिए छात्रवृत्ति योजना?", "वरिष्ठ नागरिकों के लिए पेंशन योजना?",
+    "स्टार्टअप के लिए वित्तीय सहायता कैसे मिलेगी?", "ग्रामीण परिवारों के लिए आवास योजना?",
+]
+
+
+def synthesize_schemes(count, seed=0):
+    # Records follow the scheme_data.json layout read by chunk_documents
+    rng = random.Random(seed)
+    schemes = []
+    for i in range(count):
+        topic = rng.choice(TOPICS)
+        benefit = rng.choice(BENEFITS).format(n=rng.randint(1, 50))
+        name = f"Pradhan Mantri {topic.title()} Scheme {i}"
+        schemes.append({
+            "data": {
+                "scheme_name": name,
+                "ministry": rng.choice(MINISTRIES),
+                "department": f"Department {rng.randint(1, 40)}",
+                "details_content": [
+                    f"{name} provides {benefit} to {topic}.",
+                    f"The scheme aims to improve the livelihood of {topic} across {rng.randint(2, 28)} states.",
+                ],
+                "eligibility_content": [
+                    f"The applicant must be aged between {rng.randint(14, 25)} and {rng.randint(35, 65)} years.",
+                    f"Annual family income should not exceed Rs {rng.randint(1, 8)} lakh.",
+                ],
+                "application_process": [
+                    "Step 1: Register on the official portal.",
+                    "Step 2: Upload the required documents and submit the form.",
+                    f"Website Link: https://scheme{i}.gov.in",
+                ],
+            }
+        })
+    return schemes
+
+
+def synthesize_questions(count, seed=1):
+    rng = random.Random(seed)
+    return [rng.choice(QUESTIONS).format(topic=rng.choice(TOPICS)) for _ in range(count)]
+
+
+def write_schemes(schemes, directory):
+    path = os.path.join(directory, f"schemes_{len(schemes)}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(schemes, f)
+    return path
+
+
+def latency_summary(latencies):
+    values = np.asarray(latencies, dtype=np.float64) * 1000
+    return {
+        "count": int(values.size),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+    }
+
+
+def timed_call(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_ingest(rag, json_path):
+    # Builds into a new state version with empty caches, so later stages never
+    # reuse retrievals or answers cached from the previous corpus
+    rag.json_path = json_path
+    rag.state = IndexState(rag.state.version + 1)
+    clear_caches(rag)
+    (chunks, metadata), chunk_seconds = timed_call(rag.chunk_documents)
+    rag.chunks, rag.metadata = chunks, metadata
+    _, index_seconds = timed_call(rag.create_index)
+    return {
+        "chunks": len(chunks),
+        "chunk_documents_s": chunk_seconds,
+        "chunk_documents_per_s": len(chunks) / chunk_seconds if chunk_seconds else None,
+        "create_index_s": index_seconds,
+        "create_index_per_s": len(chunks) / index_seconds if index_seconds else None,
+    }
+
+
+def bench_query(rag, questions, top_k):
+    # Measure encode + search on every call, not repeat-question cache hits
+    caches = rag.query_embeddings, rag.retrieval_cache
+    rag.query_embeddings, rag.retrieval_cache = LRUCache(0), LRUCache(0)
+    try:
+        latencies = [timed_call(rag.query, q, top_k=top_k)[1] for q in questions]
+    finally:
+        rag.query_embeddings, rag.retrieval_cache = caches
+    summary = latency_summary(latencies)
+    summary["qps"] = len(questions) / sum(latencies)
+    return summary
+
+
+def bench_query_batch(rag, questions, top_k, batch_size):
+    latencies = []
+    for start in range(0, len(questions), batch_size):
+        latencies.append(timed_call(rag.query_batch, questions[start:start + batch_size], top_k=top_k)[1])
+    summary = latency_summary(latencies)
+    summary["batch_size"] = batch_size
+    summary["qps"] = len(questions) / sum(latencies)
+    return summary
+
+
+def clear_caches(rag):
+    rag.query_embeddings.clear()
+    rag.retrieval_cache.clear()
+    rag.answer_cache.clear()
+
+
+def bench_warmup(rag, questions, top_k):
+    # First-request latency after a restart, without and with the warm-up stage
+    hot = list(dict.fromkeys(questions))
+    clear_caches(rag)
+    cold = latency_summary([timed_call(rag.query, q, top_k=top_k)[1] for q in hot])
+    clear_caches(rag)
+    stats = warm(rag, hot, top_k=top_k)
+    warmed = latency_summary([timed_call(rag.query, q, top_k=top_k)[1] for q in hot])
+    clear_caches(rag)
+    return {"hot_questions": len(hot), "warmup_s": stats["seconds"], "cold": cold, "warm": warmed}
+
+
+def bench_thread_sweep(rag, questions, top_k, batch_size, thread_counts, concurrency):
+    # Retrieval throughput per library thread count; `concurrency` client
+    # threads stand in for simultaneous requests to one worker
+    runs = []
+    for threads in thread_counts:
+        set_threads(threads)
+        rag.query_embeddings.clear()
+        run = {"threads": threads, "query": bench_query(rag, questions, top_k)}
+        rag.query_embeddings.clear()
+        run["query_batch"] = bench_query_batch(rag, questions, top_k, batch_size)
+        rag.query_embeddings.clear()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            _, seconds = timed_call(lambda: list(pool.map(lambda q: rag.query(q, top_k=top_k), questions)))
+        run["concurrent"] = {"concurrency": concurrency, "qps": len(questions) / seconds}
+        runs.append(run)
+        print(f"threads={threads}: query p99 {run['query']['p99_ms']:.2f}ms, batch {run['query_batch']['qps']:.0f} q/s, "
+              f"{concurrency} concurrent {run['concurrent']['qps']:.0f} q/s")
+    set_threads(rag.runtime["threads"] or os.cpu_count())
+    return runs
+
+
+def bench_shards(rag, questions, top_k, shard_counts, concurrency):
+    # Search-only latency and throughput of the current index split across
+    # N worker processes; every run must return the unsharded top-k
+    embeddings = encode_batched(rag.embedding_model, questions)
+    base = rag.index.to_faiss() if hasattr(rag.index, "to_faiss") else rag.index
+    _, expected = base.search(embeddings, top_k)
+    runs = []
+    for shards in shard_counts:
+        index = base if shards <= 1 else ShardedIndex.from_index(base, shards)
+        try:
+            latencies = []
+            for row in embeddings:
+                _, seconds = timed_call(index.search, row.reshape(1, -1), top_k)
+                latencies.append(seconds)
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                results, seconds = timed_call(
+                    lambda: list(pool.map(lambda row: index.search(row.reshape(1, -1), top_k)[1][0], embeddings)))
+        finally:
+            if index is not base:
+                index.close()
+        run = {"shards": shards, "search": latency_summary(latencies),
+               "concurrent": {"concurrency": concurrency, "qps": len(embeddings) / seconds},
+               "matches_unsharded": bool(np.array_equal(np.asarray(results), expected))}
+        runs.append(run)
+        print(f"shards={shards}: search p50 {run['search']['p50_ms']:.2f}ms, {concurrency} concurrent "
+              f"{run['concurrent']['qps']:.0f} q/s, matches unsharded: {run['matches_unsharded']}")
+    return runs
+
+
+def bench_encoder(model, questions, batch_size):
+    # Per-query and batched encode cost of one embedding model
+    model.encode(questions[0])  # warm-up
+    single = latency_summary([timed_call(model.encode, q)[1] for q in questions])
+    _, batch_seconds = timed_call(encode_batched, model, questions, batch_size)
+    single["batch_qps"] = len(questions) / batch_seconds if batch_seconds else None
+    return single
+
+
+def bench_encoders(model_names, questions, batch_size, backends=("torch",)):
+    hindi = [HINDI_QUESTIONS[i % len(HINDI_QUESTIONS)] for i in range(len(questions))]
+    results = {}
+    for name in model_names:
+        for backend in backends:
+            model, load_seconds = timed_call(load_encoder, name, backend)
+            key = name if backend == "torch" else f"{name} [{backend}]"
+            results[key] = {"backend": backend, "load_s": load_seconds,
+                            "english": bench_encoder(model, questions, batch_size),
+                            "hindi": bench_encoder(model, hindi, batch_size)}
+            if backend != "torch":
+                # How far the exported / quantised model drifts from torch
+                results[key]["vs_torch"] = compare_encoders(load_encoder(name, "torch"), model, questions + hindi)
+            print(f"{key}: english p50 {results[key]['english']['p50_ms']:.2f}ms, "
+                  f"hindi p50 {results[key]['hindi']['p50_ms']:.2f}ms, batch {results[key]['english']['batch_qps']:.0f} q/s")
+    return results
+
+
+class MockGenerationBackend:
+    # Stands in for the Hugging Face endpoint with a fixed service time
+    def __init__(self, latency_s):
+        self.latency_s = latency_s
+        self.calls = 0
+
+    def post(self, url, headers=None, json=None, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency_s)
+        response = mock.Mock()
+        response.status_code = 200
+        response.raise_for_status.return_value = None
+        response.json.return_value = [{"generated_text": (
+            "Scheme Name: Mock Scheme\nPurpose: Benchmark answer.\nEligibility: Everyone.\n"
+            "Application Process:\n1. Apply online.\n2. Submit documents.\n\nWebsite Link: https://mock.gov.in"
+        )}]
+        return response
+
+
+def bench_end_to_end(rag, questions, top_k, batch_size, generation_latency_s):
+    backend = MockGenerationBackend(generation_latency_s)
+    hf_token, admission = rag.hf_token, rag.admission
+    answer_cache, retrieval_cache = rag.answer_cache, rag.retrieval_cache
+    rag.hf_token = rag.hf_token or "benchmark"
+    # Measure the pipeline, not the production rate limits or repeat-question cache hits
+    rag.admission = AdmissionController(global_rate=1e9, global_burst=1e9, key_rate=1e9, key_burst=1e9)
+    rag.answer_cache, rag.retrieval_cache = LRUCache(0), LRUCache(0)
+    try:
+        with mock.patch("rag.requests.post", backend.post):
+            latencies = [timed_call(rag.answer, q, top_k=top_k)[1] for q in questions]
+            sequential = latency_summary(latencies)
+            sequential["qps"] = len(questions) / sum(latencies)
+
+            batch_latencies = []
+            for start in range(0, len(questions), batch_size):
+                batch_latencies.append(timed_call(rag.answer_batch, questions[start:start + batch_size], top_k=top_k)[1])
+            batched = latency_summary(batch_latencies)
+            batched["batch_size"] = batch_size
+            batched["qps"] = len(questions) / sum(batch_latencies)
+    finally:
+        rag.hf_token, rag.admission = hf_token, admission
+        rag.answer_cache, rag.retrieval_cache = answer_cache, retrieval_cache
+    return {"generation_latency_ms": generation_latency_s * 1000, "backend_calls": backend.calls,
+            "answer": sequential, "answer_batch": batched}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_environment():
+    return {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark GovernmentSchemeRAG ingest, retrieval and answers.")
+    parser.add_argument("--sizes", default="1000,10000", help="Comma-separated scheme counts, e.g. 1000,100000,1000000")
+    parser.add_argument("--queries", type=int, default=200, help="Questions per retrieval benchmark")
+    parser.add_argument("--answer-queries", type=int, default=20, help="Questions per end-to-end benchmark")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--generation-latency-ms", type=float, default=300.0,
+                        help="Service time of the mocked generation backend")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--encoders", default="",
+                        help="Comma-separated embedding models to compare, e.g. "
+                             "all-MiniLM-L6-v2,paraphrase-multilingual-MiniLM-L12-v2")
+    parser.add_argument("--warmup", action="store_true",
+                        help="Compare first-request retrieval latency with and without the startup warm-up")
+    parser.add_argument("--thread-sweep", default="",
+                        help="Comma-separated torch/FAISS thread counts to compare on the last corpus size, e.g. 1,2,4")
+    parser.add_argument("--concurrency", type=int, default=4, help="Client threads for the thread sweep")
+    parser.add_argument("--encoder-backends", default="torch",
+                        help="Comma-separated encoder backends for --encoders, e.g. torch,onnx,onnx-int8")
+    parser.add_argument("--shards", default="",
+                        help="Comma-separated shard worker counts to compare on the largest size, e.g. 1,2,4")
+    parser.add_argument("--output", help="Append the results as one JSON line to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    questions = synthesize_questions(args.queries, seed=args.seed + 1)
+    answer_questions = questions[:args.answer_queries]
+
+    record = {"environment": run_environment(), "args": vars(args), "runs": []}
+    with tempfile.TemporaryDirectory() as tmp:
+        # Load the embedding model once on a tiny corpus, then re-ingest each size
+        rag = GovernmentSchemeRAG(write_schemes(synthesize_schemes(8, seed=args.seed), tmp))
+        for size in sizes:
+            json_path = write_schemes(synthesize_schemes(size, seed=args.seed), tmp)
+            run = {"schemes": size}
+            run["ingest"] = bench_ingest(rag, json_path)
+            run["query"] = bench_query(rag, questions, args.top_k)
+            run["query_batch"] = bench_query_batch(rag, questions, args.top_k, args.batch_size)
+            if args.warmup:
+                run["warmup"] = bench_warmup(rag, questions, args.top_k)
+            run["end_to_end"] = bench_end_to_end(rag, answer_questions, args.top_k, args.batch_size,
+                                                 args.generation_latency_ms / 1000)
+            record["runs"].append(run)
+            print(f"{size} schemes: ingest {run['ingest']['create_index_s']:.2f}s, "
+                  f"query p50 {run['query']['p50_ms']:.2f}ms, batch {run['query_batch']['qps']:.0f} q/s")
+            os.remove(json_path)
+        thread_counts = [int(n) for n in args.thread_sweep.split(",") if n.strip()]
+        if thread_counts:
+            record["thread_sweep"] = bench_thread_sweep(rag, questions, args.top_k, args.batch_size, thread_counts,
+                                                        args.concurrency)
+        shard_counts = [int(n) for n in args.shards.split(",") if n.strip()]
+        if shard_counts:
+            record["shards"] = bench_shards(rag, questions, args.top_k, shard_counts, args.concurrency)
+    encoder_names = [name for name in args.encoders.split(",") if name.strip()]
+    backends = [name for name in args.encoder_backends.split(",") if name.strip()]
+    if backends != ["torch"] and not encoder_names:
+        encoder_names = [DEFAULT_MODEL]
+    if encoder_names:
+        record["encoders"] = bench_encoders(encoder_names, questions, args.batch_size, backends)
+    record["stages"] = REGISTRY.snapshot().get("rag_stage_seconds", {})
+
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+    else:
+        print(json.dumps(record, indent=2))
+    return record
+
+
+if __name__ == "__main__":
+    main()
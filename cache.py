@@ -0,0 +1,49 @@
+### Small thread-safe LRU cache shared by the embedding, retrieval and answer caches
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            value = self.data.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.data
+
+    def __len__(self):
+        with self.lock:
+            return len(self.data)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"size": len(self.data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,84 @@
+### Structured scheme cards extracted once at ingest and served by scheme id
+import re
+
+from extractive import split_sentences
+
+CARD_FIELDS = ("scheme_name", "ministry", "department", "purpose", "eligibility", "benefits", "steps", "links")
+MAX_PURPOSE_CHARS = 300
+
+_URL_RE = re.compile(r'https?://[^\s<>"\')\]]+')
+_BULLET_RE = re.compile(r'^\s*(?:[-*•]+|\(?[a-z0-9]{1,2}[.)])\s+', re.IGNORECASE)
+_STEP_PREFIX_RE = re.compile(r'^\s*(?:step\s*\d+\s*[:.)-]?|\d+\s*[.)]|[-*•]+)\s*', re.IGNORECASE)
+_LINK_LINE_RE = re.compile(r'^\s*(?:website\s+link|link|url|portal)\s*:\s*https?://\S+\s*$', re.IGNORECASE)
+_BENEFIT_RE = re.compile(
+    r'\b(?:benefits?|assistance|subsid(?:y|ies)|loans?|grants?|scholarships?|insurance|pensions?|stipends?|'
+    r'incentives?|reimburse\w*|free)\b|\bRs\.?\s*\d|₹\s*\d|\d+\s*%', re.IGNORECASE)
+
+
+def _items(content):
+    # The scheme JSON holds either a list of strings or a single string
+    if content is None:
+        return []
+    if not isinstance(content, list):
+        content = [content]
+    return [str(item).strip() for item in content if item is not None and str(item).strip()]
+
+
+def _sentences(text):
+    return [text[start:end].strip() for start, end in split_sentences(text)]
+
+
+def _links(texts):
+    links = []
+    for text in texts:
+        for url in _URL_RE.findall(text):
+            url = url.rstrip(".,;:")
+            if url not in links:
+                links.append(url)
+    return links
+
+
+def build_card(data):
+    details = _items(data.get("details_content"))
+    eligibility = _items(data.get("eligibility_content"))
+    process = _items(data.get("application_process"))
+
+    benefits, purpose = [], []
+    for sentence in (s for item in details for s in _sentences(item)):
+        if _BENEFIT_RE.search(sentence):
+            benefits.append(sentence)
+        elif sum(len(s) for s in purpose) < MAX_PURPOSE_CHARS:
+            purpose.append(sentence)
+
+    return {
+        "scheme_name": data.get("scheme_name", "Unknown Scheme"),
+        "ministry": data.get("ministry", "Unknown Ministry"),
+        "department": data.get("department", "Unknown Department"),
+        "purpose": " ".join(purpose),
+        "eligibility": [_BULLET_RE.sub("", item) for item in eligibility],
+        "benefits": benefits,
+        "steps": [_STEP_PREFIX_RE.sub("", item) for item in process if not _LINK_LINE_RE.match(item)],
+        "links": _links(details + eligibility + process),
+    }
+
+
+def render_card(card):
+    # Markdown in the same section layout as formatted LLM answers
+    lines = [
+        f"**Scheme Name:** {card['scheme_name']}",
+        f"**Ministry/Department:** {card['ministry']} / {card['department']}",
+    ]
+    if card["purpose"]:
+        lines.append(f"**Purpose:** {card['purpose']}")
+    if card["benefits"]:
+        lines.append("**Benefits:**")
+        lines.extend(f"- {item}" for item in card["benefits"])
+    if card["eligibility"]:
+        lines.append("**Eligibility:**")
+        lines.extend(f"- {item}" for item in card["eligibility"])
+    if card["steps"]:
+        lines.append("**Application Process:**")
+        lines.extend(f"{i}. {step}" for i, step in enumerate(card["steps"], 1))
+    if card["links"]:
+        lines.append(f"**Website Link:** [{card['links'][0]}]({card['links'][0]})")
+    return "\n".join(lines)
@@ -0,0 +1,61 @@
+### Thin client for the HTTP API in api.py
+import requests
+
+
+class RemoteSchemeRAG:
+    # Mirrors the parts of GovernmentSchemeRAG the Streamlit UI uses, so the UI
+    # can run against a shared API deployment instead of loading its own model.
+    def __init__(self, base_url, timeout=120):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        data = self._get("/metadata")
+        # Index version the ids in self.metadata belong to
+        self.metadata, self.version = data["metadata"], data.get("version")
+        self._ministries = None
+
+    def _get(self, path, params=None):
+        response = self.session.get(self.base_url + path, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def _post(self, path, payload):
+        response = self.session.post(self.base_url + path, json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def ministries(self):
+        # Same filter options as GovernmentSchemeRAG.ministries, from the metadata fetched at start
+        if self._ministries is None:
+            self._ministries = sorted({m.get("ministry", "Unknown") for meta in self.metadata
+                                       for m in [meta] + meta.get("variants", [])})
+        return self._ministries
+
+    def health(self):
+        return self._get("/health")
+
+    def _card(self, chunk_id, version=None):
+        # None for an id the server does not have (404) or one from another index version (409)
+        try:
+            return self._get(f"/schemes/{chunk_id}/card", {"version": version} if version is not None else None)
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code in (404, 409):
+                return None
+            raise
+
+    def get_card(self, chunk_id, version=None):
+        card = self._card(chunk_id, version)
+        return card["card"] if card else None
+
+    def render_card(self, chunk_id, version=None):
+        card = self._card(chunk_id, version)
+        return card["markdown"] if card else None
+
+    def query(self, question, top_k=3):
+        return self._post("/retrieve", {"question": question, "top_k": top_k})["results"]
+
+    def answer(self, question, top_k=3, ministry=None):
+        return self._post("/answer", {"question": question, "top_k": top_k, "ministry": ministry})
+
+    def answer_batch(self, questions, top_k=3, ministry=None):
+        return self._post("/answer/batch", {"questions": list(questions), "top_k": top_k, "ministry": ministry})["answers"]
@@ -0,0 +1,149 @@
+### Several scheme corpora in one process: shared encoder, on-demand loading, LRU memory budget
+# RAG_CORPORA=corpora.json, for example
+#   {"central": {"snapshot": "snapshots/central"},
+#    "maharashtra": {"snapshot": "snapshots/mh", "json": "mh_schemes.json"},
+#    "archived": {"json": "archived_schemes.json"}}
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from cache import LRUCache
+from metrics import REGISTRY, timed, trace
+from rag import GovernmentSchemeRAG
+from singleflight import SingleFlight
+
+CORPUS_EVENTS = REGISTRY.counter("rag_corpus_events_total", "Corpus indexes loaded and evicted, by corpus.")
+ALL_CORPORA = "*"
+
+
+def load_corpora_config(path):
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    if not isinstance(config, dict) or not config:
+        raise ValueError(f"{path} must map corpus names to {{\"snapshot\": dir}} and/or {{\"json\": path}}.")
+    for name, entry in config.items():
+        if not isinstance(entry, dict) or not (entry.get("snapshot") or entry.get("json")):
+            raise ValueError(f"Corpus {name!r} in {path} needs a 'snapshot' directory or a 'json' file.")
+    return config
+
+
+def corpus_bytes(rag):
+    # Estimated size of one loaded corpus: vectors, sentence index, chunk text,
+    # metadata and cards. Snapshot files are memory-mapped, so this is what the
+    # corpus can pin in the page cache rather than private heap.
+    state = rag.state
+    total = state.index.ntotal * state.index.d * 4 if state.index is not None else 0
+    if state.sentence_index is not None:
+        total += sum(array.nbytes for array in (state.sentence_index.embeddings, state.sentence_index.offsets,
+                                                state.sentence_index.spans))
+    for store in (state.chunks, state.metadata, state.cards):
+        if store is None:
+            continue
+        if hasattr(store, "nbytes"):
+            total += store.nbytes()
+        else:
+            total += sum(len(item) if isinstance(item, str) else len(json.dumps(item)) for item in store)
+    return total
+
+
+class CorpusRegistry:
+    # Each corpus is a GovernmentSchemeRAG loaded on first use. They all share
+    # the process-wide encoder (load_encoder) and one query-embedding cache,
+    # so fanning a question out across corpora encodes it once. The least
+    # recently used corpora are dropped when the loaded total exceeds
+    # memory_budget bytes; requests already holding one finish normally
+    # (shard workers of an evicted corpus stop after RAG_RELOAD_GRACE).
+    def __init__(self, config, hf_token="", memory_budget=None, default=None, **rag_kwargs):
+        self.config = config
+        self.hf_token = hf_token
+        if memory_budget is None:
+            memory_budget = int(float(os.getenv("RAG_CORPUS_MEMORY_MB", "0")) * 1024 * 1024)
+        self.memory_budget = memory_budget  # 0 = no limit
+        self.default = default or os.getenv("RAG_DEFAULT_CORPUS") or next(iter(config))
+        if self.default not in config:
+            raise ValueError(f"Default corpus {self.default!r} is not configured.")
+        self.rag_kwargs = rag_kwargs
+        self.query_embeddings = LRUCache(int(os.getenv("RAG_QUERY_EMBEDDING_CACHE", "1024")))
+        self.loaded = OrderedDict()  # name -> (rag, estimated bytes), least recently used first
+        self.lock = threading.Lock()
+        self._loads = SingleFlight("corpus")
+
+    def names(self, corpora=None):
+        # None -> the default corpus, "*" -> every configured corpus
+        if corpora is None:
+            return [self.default]
+        if isinstance(corpora, str):
+            corpora = list(self.config) if corpora == ALL_CORPORA else [corpora]
+        unknown = [name for name in corpora if name not in self.config]
+        if unknown:
+            raise KeyError(f"Unknown corpus {', '.join(map(repr, unknown))}; expected one of {', '.join(self.config)}.")
+        return list(dict.fromkeys(corpora))
+
+    def get(self, name=None):
+        name = self.names(name)[0]
+        with self.lock:
+            entry = self.loaded.get(name)
+            if entry is not None:
+                self.loaded.move_to_end(name)
+                return entry[0]
+        # Concurrent first requests for a corpus share one load
+        return self._loads.do(name, self._load, name)
+
+    def _load(self, name):
+        with self.lock:
+            if name in self.loaded:
+                return self.loaded[name][0]
+        entry = self.config[name]
+        snapshot_dir = entry.get("snapshot")
+        if snapshot_dir and not os.path.isdir(snapshot_dir):
+            if not entry.get("json"):
+                raise FileNotFoundError(f"Snapshot {snapshot_dir} for corpus {name!r} does not exist.")
+            snapshot_dir = None
+        with timed("corpus_load"):
+            rag = GovernmentSchemeRAG(entry.get("json", ""), self.hf_token, snapshot_dir=snapshot_dir,
+                                      query_embeddings=self.query_embeddings, **self.rag_kwargs)
+        size = corpus_bytes(rag)
+        CORPUS_EVENTS.inc(corpus=name, event="loaded")
+        print(f"Corpus {name!r} loaded ({size / 1e6:.1f} MB).")
+        with self.lock:
+            self.loaded[name] = (rag, size)
+            self._evict()
+        return rag
+
+    def _evict(self):
+        # Called with the lock held; never evicts the corpus just loaded
+        while self.memory_budget and len(self.loaded) > 1 and self.used_bytes() > self.memory_budget:
+            name, (rag, size) = self.loaded.popitem(last=False)
+            rag.close()
+            CORPUS_EVENTS.inc(corpus=name, event="evicted")
+            print(f"Corpus {name!r} evicted ({size / 1e6:.1f} MB) to stay within the memory budget.")
+
+    def used_bytes(self):
+        return sum(size for _, size in self.loaded.values())
+
+    def query(self, question, corpora=None, top_k=3):
+        # Results carry a "corpus" field; ids are only unique within a corpus.
+        # Every corpus shares one model, so L2 scores merge directly.
+        names = self.names(corpora)
+        with trace("query", top_k=top_k, corpora=names) as current:
+            merged = []
+            for name in names:
+                merged.extend(dict(r, corpus=name) for r in self.get(name).query(question, top_k=top_k))
+            if len(names) > 1:
+                merged.sort(key=lambda r: r["score"])
+                merged = merged[:top_k]
+            current.fields.update(question=question, ids=[r["id"] for r in merged],
+                                  scores=[round(r["score"], 4) for r in merged],
+                                  result_corpora=[r["corpus"] for r in merged])
+            return merged
+
+    def answer(self, question, corpus=None, **kwargs):
+        response = self.get(corpus).answer(question, **kwargs)
+        return dict(response, corpus=self.names(corpus)[0])
+
+    def stats(self):
+        with self.lock:
+            loaded = {name: {"bytes": size, "vectors": rag.index.ntotal} for name, (rag, size) in self.loaded.items()}
+        return {"corpora": list(self.config), "default": self.default, "loaded": loaded,
+                "used_bytes": sum(entry["bytes"] for entry in loaded.values()), "budget_bytes": self.memory_budget}
@@ -0,0 +1,161 @@
+### Near-duplicate scheme detection at ingest: MinHash signatures and LSH banding
+# python dedup.py scheme_data.json [--threshold 0.8]
+import argparse
+import re
+import time
+import zlib
+
+import numpy as np
+
+from metrics import REGISTRY
+
+DEDUP_COLLAPSED = REGISTRY.counter("rag_dedup_collapsed_total", "Scheme records folded into a near-duplicate at ingest.")
+NUM_PERM = 128
+SHINGLE_WORDS = 5
+MAX_LEADERS = 8
+_SHIFT = np.uint64(32)
+_EMPTY = np.uint64(1 << 32)  # above any 32-bit hash value
+_WORD = re.compile(r"\w+")
+
+
+def shingles(text, size=SHINGLE_WORDS):
+    # Overlapping word n-grams of the lower-cased text
+    words = _WORD.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class MinHasher:
+    # num_perm multiply-add-shift hashes ((a * x + b) mod 2**64) >> 32 over
+    # CRC32 shingle hashes; the share of equal positions in two signatures
+    # estimates the Jaccard similarity of their shingle sets
+    def __init__(self, num_perm=NUM_PERM, seed=1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.a = rng.integers(0, np.iinfo(np.uint64).max, num_perm, dtype=np.uint64, endpoint=True)
+        self.b = rng.integers(0, np.iinfo(np.uint64).max, num_perm, dtype=np.uint64, endpoint=True)
+
+    def signature(self, text):
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles(text)), dtype=np.uint64)
+        if hashes.size == 0:
+            return np.full(self.num_perm, _EMPTY, dtype=np.uint64)
+        return ((np.outer(hashes, self.a) + self.b) >> _SHIFT).min(axis=0)
+
+
+def lsh_bands(threshold, num_perm=NUM_PERM):
+    # (bands, rows) whose S-curve midpoint (1/bands)**(1/rows) is the highest
+    # one not above threshold: pairs at the threshold are almost always
+    # candidates, and candidates are checked against the threshold afterwards
+    options = [(b, num_perm // b) for b in range(1, num_perm + 1) if num_perm % b == 0]
+    below = [option for option in options if (1 / option[0]) ** (1 / option[1]) <= threshold]
+    return max(below, key=lambda o: (1 / o[0]) ** (1 / o[1])) if below else options[-1]
+
+
+def near_duplicates(texts, threshold=0.8, num_perm=NUM_PERM):
+    # Cluster id per text: the position of the first text in its cluster.
+    # Only texts sharing an LSH bucket are compared, so the cost grows with
+    # the number of texts, not the number of pairs.
+    if not texts:
+        return []
+    hasher = MinHasher(num_perm)
+    signatures = np.vstack([hasher.signature(text) for text in texts])
+    bands, rows = lsh_bands(threshold, num_perm)
+    parent = list(range(len(texts)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for band in range(bands):
+        block = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+        buckets = {}
+        for i, row in enumerate(block):
+            buckets.setdefault(row.tobytes(), []).append(i)
+        for members in buckets.values():
+            # Each member joins the first of a few leaders it is close enough to
+            leaders = []
+            for i in members:
+                for leader in leaders:
+                    if np.mean(signatures[i] == signatures[leader]) >= threshold:
+                        a, b = find(i), find(leader)
+                        parent[max(a, b)] = min(a, b)
+                        break
+                else:
+                    if len(leaders) < MAX_LEADERS:
+                        leaders.append(i)
+    return [find(i) for i in range(len(texts))]
+
+
+def collapse(chunks, metadata, cards=None, threshold=0.8, records=None):
+    # Keeps the first record of each near-duplicate cluster. The others are
+    # not indexed; they are listed under metadata["variants"] of the one kept,
+    # with their source record number. Returns (chunks, metadata, cards, report).
+    start = time.perf_counter()
+    records = records if records is not None else range(len(chunks))
+    clusters = near_duplicates(chunks, threshold)
+    kept_chunks, kept_metadata, kept_cards, position = [], [], [] if cards is not None else None, {}
+    saved_bytes = 0
+    for i, cluster in enumerate(clusters):
+        if cluster == i:
+            position[i] = len(kept_chunks)
+            kept_chunks.append(chunks[i])
+            kept_metadata.append(dict(metadata[i]))
+            if cards is not None:
+                kept_cards.append(cards[i])
+        else:
+            kept_metadata[position[cluster]].setdefault("variants", []).append(dict(metadata[i], record=records[i]))
+            saved_bytes += len(chunks[i].encode("utf-8"))
+    collapsed = len(chunks) - len(kept_chunks)
+    DEDUP_COLLAPSED.inc(collapsed)
+    sizes = [len(meta.get("variants", ())) + 1 for meta in kept_metadata]
+    report = {
+        "records": len(chunks),
+        "kept": len(kept_chunks),
+        "collapsed": collapsed,
+        "clusters": sum(size > 1 for size in sizes),
+        "largest_cluster": max(sizes, default=0),
+        "chunk_bytes_saved": saved_bytes,
+        "threshold": threshold,
+        "seconds": time.perf_counter() - start,
+    }
+    return kept_chunks, kept_metadata, kept_cards, report
+
+
+def summary(report):
+    share = report["collapsed"] / report["records"] if report["records"] else 0.0
+    return (f"Near-duplicates: {report['collapsed']} of {report['records']} records folded into "
+            f"{report['clusters']} clusters (largest {report['largest_cluster']}) at Jaccard >= {report['threshold']}; "
+            f"{share:.1%} fewer vectors, {report['chunk_bytes_saved'] / 1e6:.1f} MB less chunk text "
+            f"({report['seconds']:.2f}s).")
+
+
+def main(argv=None):
+    from hotswap import IndexState
+    from rag import GovernmentSchemeRAG
+
+    parser = argparse.ArgumentParser(description="List the near-duplicate schemes ingest would collapse.")
+    parser.add_argument("path", help="scheme_data.json")
+    parser.add_argument("--threshold", type=float, default=0.8, help="Estimated Jaccard similarity of word 5-grams")
+    parser.add_argument("--show", type=int, default=10, help="Clusters to list")
+    args = parser.parse_args(argv)
+
+    # Ingest's own chunking and collapse, without loading the embedding model
+    rag = GovernmentSchemeRAG.__new__(GovernmentSchemeRAG)
+    rag.state = IndexState()
+    rag.json_path, rag.dedup_threshold = args.path, args.threshold
+    _, metadata = rag.chunk_documents()
+    report = getattr(rag, "dedup_report", None)
+    if report is None:
+        return None
+    clusters = sorted((meta for meta in metadata if meta.get("variants")), key=lambda m: -len(m["variants"]))
+    for meta in clusters[:args.show]:
+        print(f"  {meta['scheme_name']} ({meta['ministry']}): {len(meta['variants'])} variants, e.g. "
+              + "; ".join(v["scheme_name"] for v in meta["variants"][:3]))
+    return report
+
+
+if __name__ == "__main__":
+    main()
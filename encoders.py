@@ -0,0 +1,213 @@
+### Embedding models, loaded once per process, plus an on-disk corpus embedding cache
+import hashlib
+import json
+import os
+import sys
+import threading
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+DEFAULT_MODEL = os.getenv("RAG_EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+# Same 384-dimensional space as the default model, but trained on 50+ languages
+# including Hindi, Bengali, Marathi, Tamil, Telugu, Gujarati and Urdu, so a
+# question in any of them retrieves English scheme text directly
+MULTILINGUAL_MODEL = os.getenv("RAG_MULTILINGUAL_MODEL", "paraphrase-multilingual-MiniLM-L12-v2")
+ENCODE_BATCH_SIZE = int(os.getenv("RAG_ENCODE_BATCH_SIZE", "64"))
+# "torch" runs the SentenceTransformer as is; "onnx" and "onnx-int8" run the
+# same weights exported to ONNX (the latter with dynamic int8 quantisation)
+BACKENDS = ("torch", "onnx", "onnx-int8")
+DEFAULT_BACKEND = os.getenv("RAG_ENCODER_BACKEND", "torch")
+ONNX_DIR = os.getenv("RAG_ONNX_DIR", "onnx_models")
+ONNX_CONFIG_FILE = "encoder.json"
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def resolve_model_name(model_name=None, multilingual=False):
+    if model_name:
+        return model_name
+    return MULTILINGUAL_MODEL if multilingual else DEFAULT_MODEL
+
+
+def load_encoder(model_name, backend=None, threads=None):
+    # Every RAG instance in the process shares one copy of each model
+    backend = backend or DEFAULT_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown encoder backend {backend!r}; expected one of {', '.join(BACKENDS)}.")
+    with _models_lock:
+        model = _models.get((model_name, backend))
+        if model is None:
+            if backend == "torch":
+                model = SentenceTransformer(model_name)
+            else:
+                model = OnnxEncoder(onnx_model_dir(model_name), quantized=backend == "onnx-int8", threads=threads)
+            _models[(model_name, backend)] = model
+        return model
+
+
+def onnx_model_dir(model_name, root=ONNX_DIR):
+    # Exported on first use; needs torch once, later loads only need onnxruntime
+    directory = os.path.join(root, model_name.replace("/", "__"))
+    if not os.path.exists(os.path.join(directory, ONNX_CONFIG_FILE)):
+        export_onnx(model_name, directory)
+    return directory
+
+
+def export_onnx(model_name, directory):
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    print(f"Exporting {model_name} to ONNX in {directory}...")
+    os.makedirs(directory, exist_ok=True)
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer, tokenizer = model[0].auto_model.eval(), model.tokenizer
+    pooling = [type(module).__name__ for module in model]
+    if "Pooling" not in pooling or model[1].get_pooling_mode_str() != "mean":
+        raise ValueError(f"{model_name} does not use mean pooling; only mean-pooled models can be exported.")
+
+    sample = tokenizer(["Pradhan Mantri scheme for farmers"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    with torch.no_grad():
+        torch.onnx.export(transformer, tuple(sample[name] for name in input_names),
+                          os.path.join(directory, "model.onnx"), input_names=input_names,
+                          output_names=["last_hidden_state"], dynamic_axes=dynamic_axes, opset_version=14)
+    quantize_dynamic(os.path.join(directory, "model.onnx"), os.path.join(directory, "model.int8.onnx"),
+                     weight_type=QuantType.QInt8)
+    tokenizer.save_pretrained(directory)
+    with open(os.path.join(directory, ONNX_CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump({"model": model_name, "max_seq_length": model.max_seq_length, "normalize": "Normalize" in pooling,
+                   "dimension": model.get_sentence_embedding_dimension()}, f, indent=2)
+
+
+class OnnxEncoder:
+    # Drop-in for the SentenceTransformer.encode calls made by the RAG
+    # pipeline: tokenise, run the exported transformer, mean-pool, normalise
+    def __init__(self, directory, quantized=False, threads=None):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(directory, ONNX_CONFIG_FILE), "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+        self.tokenizer = AutoTokenizer.from_pretrained(directory)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = int(threads or os.getenv("RAG_ONNX_THREADS", "0"))  # 0 = onnxruntime default
+        options.inter_op_num_threads = 1
+        path = os.path.join(directory, "model.int8.onnx" if quantized else "model.onnx")
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def get_sentence_embedding_dimension(self):
+        return self.config["dimension"]
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, normalize_embeddings=False,
+               show_progress_bar=False, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        # Length-sorted batches pad less, as SentenceTransformer does
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        embeddings = np.zeros((len(texts), self.config["dimension"]), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            rows = order[start:start + batch_size]
+            tokens = self.tokenizer([texts[i] for i in rows], padding=True, truncation=True,
+                                    max_length=self.config["max_seq_length"], return_tensors="np")
+            feed = {name: tokens[name].astype(np.int64) for name in self.input_names}
+            hidden = self.session.run(None, feed)[0]
+            mask = tokens["attention_mask"][..., None].astype(np.float32)
+            embeddings[rows] = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.config["normalize"] or normalize_embeddings:
+            embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings[0] if single else embeddings
+
+
+def compare_encoders(reference, candidate, texts):
+    # Row-wise cosine similarity of two encoders' embeddings of the same texts
+    a = encode_batched(reference, texts)
+    b = encode_batched(candidate, texts)
+    cosine = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+    return {"min_cosine": float(cosine.min()), "mean_cosine": float(cosine.mean()),
+            "max_abs_diff": float(np.abs(a - b).max())}
+
+
+def encode_batched(model, texts, batch_size=ENCODE_BATCH_SIZE):
+    embeddings = model.encode(list(texts), batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+    return np.asarray(embeddings, dtype=np.float32).reshape(len(texts), -1)
+
+
+class EmbeddingCache:
+    # Corpus embeddings keyed by a hash of (model, text), kept in one .npz per
+    # model and scope (e.g. chunks or sentences of one JSON file), so
+    # re-indexing after an edit only encodes new or changed texts. Each
+    # encode() keeps exactly the texts it was given, so the file stays the
+    # size of the current corpus.
+    def __init__(self, directory, model_name, scope=""):
+        name = hashlib.sha1(f"{model_name}\0{scope}".encode("utf-8")).hexdigest()[:16]
+        self.path = os.path.join(directory, name + ".npz")
+        self.model_name = model_name
+        self.rows = {}
+        self.embeddings = None
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.path):
+            try:
+                with np.load(self.path) as data:
+                    embeddings = data["embeddings"]
+                    keys = data["keys"].tolist()
+                if len(keys) != len(embeddings):
+                    raise ValueError(f"{len(keys)} keys for {len(embeddings)} embeddings")
+                self.embeddings = embeddings
+                self.rows = {key: i for i, key in enumerate(keys)}
+            except Exception as e:
+                # A damaged cache only costs a full re-encode
+                print(f"Warning: ignoring unreadable embedding cache {self.path}: {e}")
+
+    def key(self, text):
+        return hashlib.sha1(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def encode(self, texts, encode):
+        keys = [self.key(text) for text in texts]
+        wanted = list(dict.fromkeys(keys))
+        cached = [key for key in wanted if key in self.rows]
+        missing = [key for key in wanted if key not in self.rows]
+        stale = len(self.rows) - len(cached)
+        if missing or stale:
+            parts = [self.embeddings[[self.rows[key] for key in cached]]] if cached else []
+            if missing:
+                by_key = dict(zip(keys, texts))
+                parts.append(np.asarray(encode([by_key[key] for key in missing]), dtype=np.float32))
+            self.embeddings = np.vstack(parts)
+            self.rows = {key: i for i, key in enumerate(cached + missing)}
+            self.save()
+        print(f"Embedding cache: {len(cached)} hits, {len(missing)} encoded, {stale} pruned.")
+        return self.embeddings[[self.rows[key] for key in keys]]
+
+    def save(self):
+        # Per-process (and thread) temp file: workers indexing at the same time
+        # each replace the cache whole instead of interleaving writes
+        keys = sorted(self.rows, key=self.rows.get)
+        tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, keys=np.asarray(keys), embeddings=self.embeddings)
+        os.replace(tmp, self.path)
+
+
+if __name__ == "__main__":
+    # python encoders.py all-MiniLM-L6-v2 [min_cosine]
+    # Exports the model and checks both ONNX variants against torch
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python encoders.py <model_name> [min_cosine]")
+        sys.exit(1)
+    min_cosine = float(sys.argv[2]) if len(sys.argv) == 3 else 0.99
+    samples = ["What schemes are available for women entrepreneurs?", "Financial assistance for farmers?",
+               "किसानों के लिए कौन सी योजनाएं उपलब्ध हैं?",
+               "Scheme: Pradhan Mantri Mudra Yojana\nMinistry: Ministry of Finance\nCollateral-free loans up to Rs 10 lakh."]
+    torch_model = load_encoder(sys.argv[1], "torch")
+    failed = False
+    for backend in ("onnx", "onnx-int8"):
+        stats = compare_encoders(torch_model, load_encoder(sys.argv[1], backend), samples)
+        print(f"{backend}: {stats}")
+        failed = failed or stats["min_cosine"] < min_cosine
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,162 @@
+### Retrieval quality evaluation against a labelled question -> scheme set
+# Gold file: one JSON object per line, e.g.
+#   {"question": "Loans for women entrepreneurs?", "schemes": ["Stand-Up India"]}
+# python evaluate.py gold.jsonl --json scheme_data.json --k 1,3,5 --baseline eval_baseline.json
+import argparse
+import json
+import math
+import sys
+import time
+
+import numpy as np
+
+from rag import GovernmentSchemeRAG
+
+
+def load_gold(path):
+    gold = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            schemes = item.get("schemes") or ([item["scheme"]] if item.get("scheme") else [])
+            if not item.get("question") or not schemes:
+                print(f"Warning: skipping gold line {line_no} without a question and at least one scheme.")
+                continue
+            gold.append({"question": item["question"], "schemes": schemes})
+    return gold
+
+
+def _normalise(name):
+    return " ".join(str(name).split()).casefold()
+
+
+def _retrieved_name(result, relevant):
+    # A chunk standing in for collapsed near-duplicates (dedup.py) counts as
+    # retrieving any of its variants
+    meta = result["metadata"]
+    names = [_normalise(meta.get("scheme_name", ""))]
+    names += [_normalise(v.get("scheme_name", "")) for v in meta.get("variants", ())]
+    return next((name for name in names if name in relevant), names[0])
+
+
+def first_relevant_rank(retrieved, relevant):
+    for rank, name in enumerate(retrieved, 1):
+        if name in relevant:
+            return rank
+    return None
+
+
+def recall_at_k(retrieved, relevant, k):
+    return len(set(retrieved[:k]) & relevant) / len(relevant)
+
+
+def ndcg_at_k(retrieved, relevant, k):
+    # Binary relevance; a scheme retrieved twice only counts once
+    seen = set()
+    dcg = 0.0
+    for rank, name in enumerate(retrieved[:k], 1):
+        if name in relevant and name not in seen:
+            dcg += 1.0 / math.log2(rank + 1)
+            seen.add(name)
+    ideal = sum(1.0 / math.log2(rank + 1) for rank in range(1, min(len(relevant), k) + 1))
+    return dcg / ideal if ideal else 0.0
+
+
+def evaluate(rag, gold, ks=(1, 3, 5)):
+    ks = sorted(set(ks))
+    max_k = ks[-1]
+    recall = {k: [] for k in ks}
+    ndcg = {k: [] for k in ks}
+    reciprocal_ranks = []
+    latencies = []
+    misses = []
+
+    for item in gold:
+        relevant = {_normalise(name) for name in item["schemes"]}
+        start = time.perf_counter()
+        results = rag.query(item["question"], top_k=max_k)
+        latencies.append(time.perf_counter() - start)
+        retrieved = [_retrieved_name(r, relevant) for r in results]
+
+        for k in ks:
+            recall[k].append(recall_at_k(retrieved, relevant, k))
+            ndcg[k].append(ndcg_at_k(retrieved, relevant, k))
+        rank = first_relevant_rank(retrieved, relevant)
+        reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+        if rank is None:
+            misses.append(item["question"])
+
+    latency_ms = np.asarray(latencies, dtype=np.float64) * 1000 if latencies else np.zeros(1)
+    return {
+        "questions": len(gold),
+        "recall": {str(k): float(np.mean(v)) if v else 0.0 for k, v in recall.items()},
+        "ndcg": {str(k): float(np.mean(v)) if v else 0.0 for k, v in ndcg.items()},
+        "mrr": float(np.mean(reciprocal_ranks)) if reciprocal_ranks else 0.0,
+        "latency_ms": {
+            "mean": float(latency_ms.mean()),
+            "p50": float(np.percentile(latency_ms, 50)),
+            "p95": float(np.percentile(latency_ms, 95)),
+            "p99": float(np.percentile(latency_ms, 99)),
+        },
+        "misses": misses,
+    }
+
+
+def compare(report, baseline, max_drop=0.01):
+    # Returns the quality metrics that dropped by more than max_drop
+    regressions = []
+    for metric in ("recall", "ndcg"):
+        for k, value in baseline.get(metric, {}).items():
+            current = report[metric].get(k)
+            if current is not None and current < value - max_drop:
+                regressions.append(f"{metric}@{k}: {value:.4f} -> {current:.4f}")
+    if "mrr" in baseline and report["mrr"] < baseline["mrr"] - max_drop:
+        regressions.append(f"mrr: {baseline['mrr']:.4f} -> {report['mrr']:.4f}")
+    return regressions
+
+
+def print_report(report):
+    print(f"Questions: {report['questions']}")
+    for k in report["recall"]:
+        print(f"  recall@{k}: {report['recall'][k]:.4f}   ndcg@{k}: {report['ndcg'][k]:.4f}")
+    print(f"  MRR: {report['mrr']:.4f}")
+    latency = report["latency_ms"]
+    print(f"  latency: p50 {latency['p50']:.2f}ms  p95 {latency['p95']:.2f}ms  p99 {latency['p99']:.2f}ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate GovernmentSchemeRAG retrieval on a gold question set.")
+    parser.add_argument("gold", help="JSON Lines file with question and schemes fields")
+    parser.add_argument("--json", default="scheme_data.json", help="Scheme JSON to index")
+    parser.add_argument("--snapshot", help="Evaluate a prebuilt snapshot directory instead")
+    parser.add_argument("--k", default="1,3,5", help="Comma-separated cut-offs")
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    parser.add_argument("--baseline", help="Report to compare against; exits non-zero on regressions")
+    parser.add_argument("--max-drop", type=float, default=0.01, help="Allowed absolute drop per metric")
+    args = parser.parse_args(argv)
+
+    rag = GovernmentSchemeRAG(args.json, snapshot_dir=args.snapshot)
+    report = evaluate(rag, load_gold(args.gold), ks=[int(k) for k in args.k.split(",") if k.strip()])
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), max_drop=args.max_drop)
+        if regressions:
+            print("Quality regressions against baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("No quality regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+### Sentence-level embedding index for extractive answers and evidence highlighting
+import re
+
+import numpy as np
+
+# Lines chunk_documents prepends to every chunk; they are metadata, not evidence
+_HEADER_PREFIXES = ("Scheme:", "Ministry:", "Department:")
+_SENTENCE_RE = re.compile(r'[^\n]+?(?:[.!?](?=\s)|$)', re.MULTILINE)
+MIN_SENTENCE_CHARS = 12
+
+
+def split_sentences(chunk):
+    # (start, end) character spans of the evidence sentences in one chunk
+    spans = []
+    for match in _SENTENCE_RE.finditer(chunk):
+        start, end = match.span()
+        while start < end and chunk[start].isspace():
+            start += 1
+        if end - start < MIN_SENTENCE_CHARS or chunk.startswith(_HEADER_PREFIXES, start):
+            continue
+        spans.append((start, end))
+    return spans
+
+
+class SentenceIndex:
+    # Row r of `embeddings` is the sentence chunks[chunk_of[r]][spans[r, 0]:spans[r, 1]].
+    # Sentences of chunk i occupy rows offsets[i]:offsets[i + 1]. Embeddings are
+    # unit-length float16, half the memory of the scheme index per row; scores
+    # are accumulated in float32.
+    def __init__(self, embeddings, offsets, spans):
+        self.embeddings = embeddings
+        self.offsets = offsets
+        self.spans = spans
+
+    @classmethod
+    def build(cls, chunks, encode, batch_size=256, cache=None):
+        # encode must return unit-length rows; with an EmbeddingCache only
+        # sentences not embedded by an earlier build hit the model
+        offsets = [0]
+        spans = []
+        texts = []
+        for chunk in chunks:
+            chunk_spans = split_sentences(chunk)
+            spans.extend(chunk_spans)
+            texts.extend(chunk[start:end] for start, end in chunk_spans)
+            offsets.append(len(spans))
+        def batched(texts):
+            return np.vstack([
+                np.asarray(encode(texts[i:i + batch_size]), dtype=np.float32)
+                for i in range(0, len(texts), batch_size)
+            ])
+
+        if texts:
+            embeddings = cache.encode(texts, batched) if cache is not None else batched(texts)
+        else:
+            embeddings = np.zeros((0, 0), dtype=np.float32)
+        return cls(np.ascontiguousarray(embeddings, dtype=np.float16), np.asarray(offsets, dtype=np.int64),
+                   np.asarray(spans, dtype=np.int32).reshape(-1, 2))
+
+    def __len__(self):
+        return len(self.spans)
+
+    def rows_for(self, chunk_ids):
+        ranges = [np.arange(self.offsets[i], self.offsets[i + 1]) for i in chunk_ids]
+        return np.concatenate(ranges) if ranges else np.zeros(0, dtype=np.int64)
+
+    def chunk_of(self, rows):
+        return np.searchsorted(self.offsets, rows, side="right") - 1
+
+    def score(self, question_embedding, chunk_ids):
+        # One matrix-vector product over every sentence of the candidate chunks
+        rows = self.rows_for(chunk_ids)
+        if rows.size == 0:
+            return rows, np.zeros(0, dtype=np.float32)
+        return rows, self.embeddings[rows].astype(np.float32) @ np.asarray(question_embedding, dtype=np.float32)
+
+    def evidence(self, question_embedding, chunk_ids, max_spans=2, min_score=0.3):
+        # Best sentences of each candidate chunk as {chunk_id: [(start, end, score)]},
+        # from a single matrix-vector product over the whole candidate set
+        rows, scores = self.score(question_embedding, chunk_ids)
+        spans = {int(i): [] for i in chunk_ids}
+        if rows.size == 0:
+            return spans
+        owners = self.chunk_of(rows)
+        for i in np.argsort(-scores):
+            if scores[i] < min_score:
+                break
+            chunk_spans = spans[int(owners[i])]
+            if len(chunk_spans) < max_spans:
+                start, end = self.spans[rows[i]]
+                chunk_spans.append((int(start), int(end), float(scores[i])))
+        for chunk_spans in spans.values():
+            chunk_spans.sort()
+        return spans
+
+
+def extract_answer(question_embedding, results, sentence_index, chunks, max_lines=3, min_score=0.3):
+    # Best-matching scheme plus its highest-scoring sentences, or None when no
+    # sentence in the retrieved chunks clears min_score
+    chunk_ids = [r["id"] for r in results]
+    rows, scores = sentence_index.score(question_embedding, chunk_ids)
+    if scores.size == 0:
+        return None
+    best = int(np.argmax(scores))
+    confidence = float(scores[best])
+    if confidence < min_score:
+        return {"confidence": confidence, "lines": []}
+
+    chunk_id = int(sentence_index.chunk_of(rows[best]))
+    mask = (sentence_index.chunk_of(rows) == chunk_id) & (scores >= min_score)
+    candidate_rows, candidate_scores = rows[mask], scores[mask]
+    top = np.argsort(-candidate_scores)[:max_lines]
+    # Keep the chosen sentences in document order
+    chosen = sorted(int(candidate_rows[i]) for i in top)
+    chunk = chunks[chunk_id]
+    lines = [chunk[sentence_index.spans[r, 0]:sentence_index.spans[r, 1]] for r in chosen]
+
+    metadata = next(r["metadata"] for r in results if r["id"] == chunk_id)
+    return {
+        "id": chunk_id,
+        "scheme_name": metadata.get("scheme_name", "Unknown Scheme"),
+        "ministry": metadata.get("ministry", "Unknown Ministry"),
+        "department": metadata.get("department", "Unknown Department"),
+        "lines": lines,
+        "confidence": confidence,
+    }
+
+
+def format_extractive(extracted):
+    lines = [
+        f"**Scheme Name:** {extracted['scheme_name']}",
+        f"**Ministry/Department:** {extracted['ministry']} / {extracted['department']}",
+        "",
+    ]
+    lines.extend(f"- {line}" for line in extracted["lines"])
+    return "\n".join(lines)
@@ -0,0 +1,196 @@
+### User feedback capture and the offline per-(query cluster, scheme) relevance boost table
+# python feedback.py history.sqlite3 boosts.npz
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from encoders import encode_batched, load_encoder, resolve_model_name
+from history import ensure_column
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS feedback (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created REAL NOT NULL,
+    session_id TEXT,
+    entry_id INTEGER,
+    question TEXT NOT NULL,
+    ministry TEXT,
+    chunk_ids TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    rating INTEGER NOT NULL,
+    scheme_keys TEXT
+);
+"""
+
+
+def scheme_key(metadata):
+    # Stable across re-indexing, unlike a chunk id (a position in the index)
+    return f"{metadata.get('scheme_name', '')} | {metadata.get('ministry', '')}"
+
+
+def result_keys(metadata):
+    # The result's own key, then those of near-duplicates collapsed into it (dedup.py)
+    return [scheme_key(metadata)] + [scheme_key(variant) for variant in metadata.get("variants", ())]
+
+
+class FeedbackStore:
+    # Shares the UI's SQLite file with HistoryStore; one row per button press
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript(SCHEMA)
+            ensure_column(self.conn, "feedback", "scheme_keys", "TEXT")
+
+    def add(self, question, chunk_ids, answer, rating, ministry=None, session_id=None, entry_id=None,
+            scheme_keys=None):
+        with self.lock, self.conn:
+            return self.conn.execute(
+                "INSERT INTO feedback (created, session_id, entry_id, question, ministry, chunk_ids, answer, rating, "
+                "scheme_keys) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), session_id, entry_id, question, ministry, json.dumps([int(i) for i in chunk_ids]),
+                 answer, 1 if rating > 0 else -1, json.dumps(list(scheme_keys)) if scheme_keys is not None else None)
+            ).lastrowid
+
+    def rows(self):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT question, ministry, chunk_ids, answer, rating, scheme_keys FROM feedback").fetchall()
+        return [{"question": q, "ministry": m, "chunk_ids": json.loads(c), "answer": a, "rating": r,
+                 "scheme_keys": json.loads(k) if k else None}
+                for q, m, c, a, r, k in rows]
+
+
+class BoostTable:
+    # Centroids of question clusters plus sparse (cluster, scheme key) -> boost
+    # entries in [-1, 1]. Keyed by scheme rather than chunk id, so a table
+    # stays valid when the corpus is re-indexed. A query costs one product
+    # against the centroid matrix and a dict lookup; no model call.
+    def __init__(self, centroids, cluster_ids, scheme_keys, boosts, answers=None, model=None):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.cluster_ids = np.asarray(cluster_ids, dtype=np.int32)
+        self.scheme_keys = np.asarray(scheme_keys, dtype=str)
+        self.boosts = np.asarray(boosts, dtype=np.float32)
+        self.answers = answers or []
+        self.model = model
+        self.by_cluster = {}
+        for cluster, key, boost in zip(self.cluster_ids.tolist(), self.scheme_keys.tolist(), self.boosts.tolist()):
+            self.by_cluster.setdefault(cluster, {})[key] = boost
+
+    def __len__(self):
+        return len(self.boosts)
+
+    def lookup(self, unit_embedding, min_similarity=0.8):
+        # Boosts of the nearest question cluster, or {} when none is close enough
+        if not len(self.centroids):
+            return {}
+        similarities = self.centroids @ unit_embedding
+        best = int(np.argmax(similarities))
+        if similarities[best] < min_similarity:
+            return {}
+        return self.by_cluster.get(best, {})
+
+    def save(self, path):
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, centroids=self.centroids, cluster_ids=self.cluster_ids, scheme_keys=self.scheme_keys,
+                     boosts=self.boosts, answers=np.asarray(json.dumps(self.answers)),
+                     model=np.asarray(self.model or ""))
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            if "scheme_keys" not in data.files:
+                raise ValueError(f"{path} refers to schemes by chunk id, which change on re-indexing; "
+                                 "rebuild it with feedback.py.")
+            return cls(data["centroids"], data["cluster_ids"], data["scheme_keys"], data["boosts"],
+                       answers=json.loads(str(data["answers"])), model=str(data["model"]) or None)
+
+
+def cluster_questions(embeddings, similarity=0.85):
+    # Greedy leader clustering on unit vectors; fine for the thousands of
+    # distinct questions feedback produces
+    centroids, sums, labels = [], [], []
+    for embedding in embeddings:
+        if centroids:
+            scores = np.asarray(centroids) @ embedding
+            best = int(np.argmax(scores))
+            if scores[best] >= similarity:
+                sums[best] = sums[best] + embedding
+                centroids[best] = sums[best] / np.linalg.norm(sums[best])
+                labels.append(best)
+                continue
+        centroids.append(embedding)
+        sums.append(embedding.copy())
+        labels.append(len(centroids) - 1)
+    return np.asarray(centroids, dtype=np.float32).reshape(len(centroids), -1), labels
+
+
+def build_boost_table(rows, encode, model=None, similarity=0.85, prior=2.0, min_boost=0.05):
+    # Ratings recorded before scheme keys were stored cannot be tied to a scheme
+    rows = [row for row in rows if row.get("scheme_keys")]
+    questions = sorted({row["question"].strip() for row in rows})
+    if not questions:
+        return BoostTable(np.zeros((0, 0), dtype=np.float32), [], [], [], model=model)
+    embeddings = np.asarray(encode(questions), dtype=np.float32)
+    embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+    centroids, labels = cluster_questions(embeddings, similarity)
+    cluster_of = dict(zip(questions, labels))
+
+    votes = {}    # (cluster, scheme key) -> [net rating, count]
+    answers = {}  # (cluster, question, ministry, answer, scheme keys) -> net rating
+    for row in rows:
+        cluster = cluster_of[row["question"].strip()]
+        for scheme in row["scheme_keys"]:
+            vote = votes.setdefault((cluster, scheme), [0, 0])
+            vote[0] += row["rating"]
+            vote[1] += 1
+        key = (cluster, row["question"].strip(), row["ministry"], row["answer"], tuple(row["scheme_keys"]))
+        answers[key] = answers.get(key, 0) + row["rating"]
+
+    # Smoothed net rating: a single vote moves a scheme a third of the way
+    entries = [(cluster, scheme, net / (count + prior)) for (cluster, scheme), (net, count) in votes.items()]
+    entries = [entry for entry in entries if abs(entry[2]) >= min_boost]
+
+    # The sources go with each answer so it is only pre-warmed while a
+    # re-indexed corpus still retrieves the schemes it was written from
+    best = {}
+    for (cluster, question, ministry, answer, schemes), net in answers.items():
+        if net > 0 and net > best.get(cluster, (0,))[0]:
+            best[cluster] = (net, {"question": question, "ministry": ministry, "answer": answer, "votes": net,
+                                   "scheme_keys": list(schemes)})
+    return BoostTable(centroids, [e[0] for e in entries], [e[1] for e in entries], [e[2] for e in entries],
+                      answers=[item for _, item in best.values()], model=model)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aggregate UI feedback into a relevance boost table.")
+    parser.add_argument("db", help="SQLite file the UI writes feedback to (RAG_HISTORY_DB)")
+    parser.add_argument("output", help="Boost table to write, e.g. boosts.npz (load with RAG_BOOST_TABLE)")
+    parser.add_argument("--model", help="Embedding model; must match the index (default: RAG_EMBEDDING_MODEL)")
+    parser.add_argument("--similarity", type=float, default=0.85, help="Cosine similarity to join a question cluster")
+    args = parser.parse_args(argv)
+
+    model_name = resolve_model_name(args.model)
+    model = load_encoder(model_name)
+    rows = FeedbackStore(args.db).rows()
+    unkeyed = sum(not row["scheme_keys"] for row in rows)
+    if unkeyed:
+        print(f"Warning: skipping {unkeyed} ratings recorded without scheme keys.")
+    table = build_boost_table(rows, lambda texts: encode_batched(model, texts), model=model_name,
+                              similarity=args.similarity)
+    table.save(args.output)
+    print(f"{len(rows)} ratings -> {len(table.centroids)} question clusters, {len(table)} boosts, "
+          f"{len(table.answers)} pre-warm answers written to {args.output}.")
+    return table
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+### Formatting of generated answers (bold section titles, links, application steps)
+import re
+
+from cards import render_card
+
+# Section titles the prompt asks the model for. "Benefits:" also matches inside
+# "Key Benefits:", which therefore renders as "Key **Benefits:**" exactly as it
+# always has, so "Key Benefits:" needs no entry of its own.
+SECTION_HEADERS = (
+    "Scheme Name:",
+    "Ministry/Department:",
+    "Purpose:",
+    "Benefits:",
+    "Eligibility:",
+    "Application Process:",
+    "Application Process Overview:",
+    "Required Documents:",
+    "Website Link:",
+    "Source:",
+)
+APPLICATION_HEADERS = ("**Application Process:**", "**Application Process Overview:**")
+LINK_PREFIX = "**Website Link:** "
+BUSY_INTRO = "The answer service is busy right now, so here are the most relevant schemes found:"
+NO_MATCHES = "No matching schemes were found. Try rephrasing the question or removing the ministry filter."
+
+# Precompiled once at import; str.replace runs in C and beats a Python-level
+# token scan for answers of this size, so headers stay a table of replaces.
+_BOLD_HEADERS = tuple((header, f"**{header}**") for header in SECTION_HEADERS)
+_URL_RE = re.compile(r'https?://[^\s]+')
+_STEP_RE = re.compile(r'^\s*\d+\.\s+')
+_SECTION_START_RE = re.compile(r'^[^\S\n]*\*\*Application Process', re.MULTILINE)
+
+
+def bold_headers(answer):
+    for header, bold in _BOLD_HEADERS:
+        answer = answer.replace(header, bold)
+    return answer
+
+
+def link_urls(answer):
+    # Only URLs given as the "Website Link:" become markdown links; everything
+    # else (and anything already formatted as a link) is left alone.
+    if LINK_PREFIX + "http" not in answer:
+        return answer
+
+    # Each distinct URL is checked against the answer once, however often it repeats
+    decided = {}
+
+    def link(match):
+        url = match.group()
+        replacement = decided.get(url)
+        if replacement is None:
+            if LINK_PREFIX + url in answer and f"[{url}]({url})" not in answer:
+                replacement = f"[{url}]({url})"
+            else:
+                replacement = url
+            decided[url] = replacement
+        return replacement
+
+    return _URL_RE.sub(link, answer)
+
+
+def format_steps(answer):
+    if not any(header in answer for header in APPLICATION_HEADERS):
+        return answer
+    # Lines before the first application section are never touched
+    start = _SECTION_START_RE.search(answer)
+    if start is None:
+        return answer
+
+    formatted_lines = []
+    in_app_process = False
+    previous_blank = False
+    for line in answer[start.start():].split('\n'):
+        stripped = line.strip()
+        if stripped.startswith("**Application Process"):
+            in_app_process = True
+            formatted_lines.append(line)
+        elif in_app_process and (_STEP_RE.match(stripped) or stripped.startswith('- ')):
+            formatted_lines.append(stripped)  # Keep numbered steps and bullet points
+        elif in_app_process and stripped == "" and not previous_blank:
+            in_app_process = False  # Assume end of section on blank line
+            formatted_lines.append(line)
+        else:
+            formatted_lines.append(line)
+        previous_blank = stripped == ""
+    return answer[:start.start()] + "\n".join(formatted_lines)
+
+
+def format_answer(answer):
+    return format_steps(link_urls(bold_headers(answer)))
+
+
+def format_retrieval_only(results, cards=None, intro=BUSY_INTRO):
+    # Answer built from retrieval metadata and precomputed scheme cards alone,
+    # used when the generation backend is saturated or rate limited
+    if not results:
+        return "The answer service is busy right now. Please try again in a moment."
+    lines = [intro, ""]
+    for i, result in enumerate(results):
+        card = cards[i] if cards else None
+        if card is not None:
+            lines.append(render_card(card))
+        else:
+            meta = result["metadata"]
+            lines.append(f"**Scheme Name:** {meta.get('scheme_name', 'Unknown Scheme')}")
+            lines.append(f"**Ministry/Department:** {meta.get('ministry', 'Unknown Ministry')} / "
+                         f"{meta.get('department', 'Unknown Department')}")
+        lines.append("")
+    return "\n".join(lines).rstrip()
@@ -0,0 +1,97 @@
+### Conversation history in SQLite, referencing sources by chunk id instead of copying chunks
+import json
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    created REAL NOT NULL,
+    question TEXT NOT NULL,
+    ministry TEXT,
+    answer TEXT NOT NULL,
+    source_ids TEXT NOT NULL,
+    source_keys TEXT
+);
+CREATE INDEX IF NOT EXISTS history_session ON history (session_id, id);
+"""
+COLUMNS = "id, session_id, created, question, ministry, answer, source_ids, source_keys"
+
+
+def ensure_column(conn, table, column, declaration):
+    # Adds a column to databases created before it existed
+    if column not in [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+
+class HistoryStore:
+    # One connection shared by every Streamlit session thread; WAL lets the
+    # API and UI processes read while another writes.
+    def __init__(self, path, max_entries_per_session=1000):
+        self.path = path
+        self.max_entries_per_session = max_entries_per_session
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript(SCHEMA)
+            ensure_column(self.conn, "history", "source_keys", "TEXT")
+
+    @staticmethod
+    def _entry(row):
+        if row is None:
+            return None
+        entry = dict(row)
+        entry["source_ids"] = json.loads(entry["source_ids"])
+        # Chunk ids change on every re-index; the scheme keys do not
+        entry["source_keys"] = json.loads(entry["source_keys"]) if entry["source_keys"] else None
+        return entry
+
+    def add(self, session_id, question, answer, source_ids, ministry=None, source_keys=None):
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO history (session_id, created, question, ministry, answer, source_ids, source_keys) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (session_id, time.time(), question, ministry, answer, json.dumps([int(i) for i in source_ids]),
+                 json.dumps(list(source_keys)) if source_keys is not None else None))
+            # Keep each session bounded on disk as well as in memory
+            self.conn.execute(
+                "DELETE FROM history WHERE session_id = ? AND id NOT IN "
+                "(SELECT id FROM history WHERE session_id = ? ORDER BY id DESC LIMIT ?)",
+                (session_id, session_id, self.max_entries_per_session))
+            return cursor.lastrowid
+
+    def count(self, session_id):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM history WHERE session_id = ?", (session_id,)).fetchone()[0]
+
+    def page(self, session_id, page=0, page_size=10):
+        # Newest first
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT {COLUMNS} FROM history WHERE session_id = ? ORDER BY id DESC LIMIT ? OFFSET ?",
+                (session_id, page_size, page * page_size)).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def top_questions(self, limit=50):
+        # Most frequently asked questions across all sessions, for cache warm-up
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT MIN(question), COUNT(*) AS asked FROM history GROUP BY LOWER(TRIM(question)) "
+                "ORDER BY asked DESC LIMIT ?", (limit,)).fetchall()
+        return [row[0] for row in rows]
+
+    def get(self, entry_id):
+        with self.lock:
+            return self._entry(self.conn.execute(f"SELECT {COLUMNS} FROM history WHERE id = ?", (entry_id,)).fetchone())
+
+    def latest(self, session_id):
+        entries = self.page(session_id, 0, 1)
+        return entries[0] if entries else None
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
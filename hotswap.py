@@ -0,0 +1,82 @@
+### Zero-downtime index reloads: one immutable state per build, swapped by reference
+import os
+import threading
+import time
+
+from metrics import REGISTRY
+from snapshot import MANIFEST_FILE
+
+RELOADS = REGISTRY.counter("rag_index_reloads_total", "Background index reloads, by outcome.")
+
+
+class IndexState:
+    # Everything a request reads from one build: vectors, chunk text,
+    # metadata, cards and the sentence index. A reload builds a whole new
+    # state and replaces the reference in one assignment (read-copy-update);
+    # a request reads rag.state once and uses that object throughout, so it
+    # never mixes ids from one build with chunks from another.
+    def __init__(self, version=0):
+        self.version = version
+        self.index = None
+        self.dimension = None
+        self.chunks = []
+        self.metadata = []
+        self.cards = None
+        self.sentence_index = None
+        self.sentence_index_lock = threading.Lock()
+        self.ministries = None  # sorted filter options, computed once per build
+        self.loaded_at = time.time()
+
+
+def source_signature(json_path, snapshot_dir=None):
+    # What the watcher compares between polls. A snapshot's manifest is
+    # replaced last, so it only changes once the whole snapshot is written.
+    path = os.path.join(snapshot_dir, MANIFEST_FILE) if snapshot_dir else json_path
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+class IndexWatcher:
+    # Polls the RAG system's source every `interval` seconds and reloads in
+    # this thread once a change has held still for one more poll, so a file
+    # still being copied in is not read half-way. A failed reload keeps the
+    # live index and is not retried until the source changes again.
+    def __init__(self, rag, interval=None):
+        self.rag = rag
+        self.interval = float(interval if interval is not None else os.getenv("RAG_RELOAD_INTERVAL", "0"))
+        if self.interval <= 0:
+            raise ValueError("IndexWatcher needs a positive polling interval (RAG_RELOAD_INTERVAL).")
+        self.stop = threading.Event()
+        self.last_error = None
+        self.thread = threading.Thread(target=self._run, name="rag-index-watcher", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _run(self):
+        seen = self.rag.source_signature()
+        pending = None
+        while not self.stop.wait(self.interval):
+            current = self.rag.source_signature()
+            if current is None or current == seen:
+                pending = None
+                continue
+            if current != pending:
+                pending = current  # changed; check it is still the same next poll
+                continue
+            try:
+                self.rag.reload()
+                self.last_error = None
+                RELOADS.inc(outcome="ok")
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                print(f"Warning: index reload failed, still serving version {self.rag.state.version}: {e}")
+                RELOADS.inc(outcome="failed")
+            seen, pending = current, None
+
+    def close(self):
+        self.stop.set()
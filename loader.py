@@ -0,0 +1,248 @@
+### Streaming scheme loader that skips and reports malformed records
+# python loader.py scheme_data.json [--errors errors.jsonl]
+import argparse
+import json
+import os
+import re
+import time
+
+from metrics import REGISTRY
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+LOAD_ERRORS = REGISTRY.counter("rag_load_errors_total", "Scheme records skipped while loading, by reason.")
+READ_SIZE = 1 << 20
+MAX_RECORD_BYTES = int(os.getenv("RAG_MAX_RECORD_BYTES", str(8 * 1024 * 1024)))
+TEXT_FIELDS = ("details_content", "eligibility_content", "application_process")
+NAME_FIELDS = ("scheme_name", "ministry", "department")
+
+_IN_OBJECT = re.compile(rb'[{}"]')
+_IN_STRING = re.compile(rb'["\\]')
+_RESYNC = re.compile(rb'\n[ \t\r]*\{')
+_LIKELY_END = re.compile(rb'\}(?=[ \t\r\n,]*(?:[{\]]|\Z))')
+_AT_END = re.compile(rb'[ \t\r\n,]*\Z')
+_SEPARATORS = b" \t\r\n,[]"
+
+
+class LoadReport:
+    # Counts for the whole file; only the first max_errors errors are kept
+    def __init__(self, path, max_errors=1000):
+        self.path = path
+        self.max_errors = max_errors
+        self.records = 0
+        self.bytes = 0
+        self.error_count = 0
+        self.errors = []
+        self.reasons = {}
+        self.seconds = 0.0
+
+    def error(self, offset, reason, message):
+        self.error_count += 1
+        self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        LOAD_ERRORS.inc(reason=reason)
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"offset": offset, "reason": reason, "message": message})
+
+    def summary(self):
+        rate = self.bytes / self.seconds / 1e6 if self.seconds else 0.0
+        text = (f"Loaded {self.records} records from {self.path} ({self.bytes / 1e6:.1f} MB in {self.seconds:.2f}s, "
+                f"{rate:.0f} MB/s); skipped {self.error_count}")
+        if self.reasons:
+            text += " (" + ", ".join(f"{n} {reason}" for reason, n in sorted(self.reasons.items())) + ")"
+        return text + "."
+
+
+def _parse(raw):
+    if orjson is not None:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            pass  # json also accepts NaN/Infinity and reports the position
+    return json.loads(raw)
+
+
+def _parse_error(e, offset, raw):
+    position = getattr(e, "pos", None)
+    if not isinstance(position, int):
+        return str(e)
+    # json reports a character index into the decoded record
+    position = len(raw.decode("utf-8", "replace")[:position].encode("utf-8"))
+    return f"{getattr(e, 'msg', e)} (byte {offset + position})"
+
+
+def _scan(f, report, read_size=READ_SIZE, max_record_bytes=MAX_RECORD_BYTES):
+    # Yields (offset, parsed value) for each top-level {...}, whether the file
+    # is one array, JSON Lines or concatenated objects, and reports whatever
+    # it has to skip. Memory is bounded by one read plus the largest record.
+    buf = f.read(read_size)
+    base = 0  # file offset of buf[0]
+    if buf.startswith(b"\xef\xbb\xbf"):
+        buf, base = buf[3:], 3
+    eof = not buf
+
+    def refill(keep_from):
+        # Drops buf[:keep_from] and appends the next read; returns the shift
+        nonlocal buf, base, eof
+        more = f.read(read_size)
+        eof = not more
+        buf = buf[keep_from:] + more
+        base += keep_from
+        return keep_from
+
+    pos, resync = 0, False
+    while True:
+        # Between records; after a broken one, skip to the next line starting with "{"
+        if resync:
+            match = _RESYNC.search(buf, pos)
+            start = match.end() - 1 if match else -1
+        else:
+            start = buf.find(b"{", pos)
+            between = buf[pos:start if start >= 0 else len(buf)]
+            junk = between.translate(None, _SEPARATORS)
+            if junk:
+                first = pos + len(between) - len(between.lstrip(_SEPARATORS))
+                report.error(base + first, "unexpected", f"skipped {len(junk)} bytes outside any record")
+        if start < 0:
+            if eof:
+                return
+            # Keep a trailing newline so a resync can match across reads
+            keep = 1 if resync and buf.endswith(b"\n") else 0
+            refill(len(buf) - keep)
+            pos = 0
+            continue
+        resync = False
+
+        # Fast path: a record almost always ends at a "}" followed by the next
+        # record or the end of the array, and then parses in one C call
+        scan_from, end = start + 1, None
+        while True:
+            match = _LIKELY_END.search(buf, scan_from)
+            if match is not None and (eof or not _AT_END.match(buf, match.end())):
+                end = match.end()
+                break
+            if eof or len(buf) - start > max_record_bytes:
+                break
+            next_from = match.start() if match is not None else len(buf)
+            shift = refill(start)
+            start, scan_from = 0, next_from - shift
+        if end is not None and end - start <= max_record_bytes:
+            try:
+                record = _parse(buf[start:end])
+            except ValueError:
+                pass  # a "}" inside a string or nested list; scan exactly below
+            else:
+                yield base + start, record
+                pos = end
+                continue
+
+        # Exact path: track strings and brace depth byte by byte (via regex)
+        pos, depth, in_string, end = start + 1, 1, False, None
+        while end is None:
+            match = (_IN_STRING if in_string else _IN_OBJECT).search(buf, pos)
+            if match is not None and in_string and buf[match.start()] == 0x5C and match.end() >= len(buf):
+                match = None  # backslash at the end of the buffer; need the escaped byte
+            if match is None:
+                if eof or pos - start > max_record_bytes:
+                    break
+                shift = refill(start)
+                start, pos = 0, pos - shift
+                continue
+            char = buf[match.start()]
+            pos = match.end()
+            if in_string:
+                if char == 0x5C:  # backslash: skip the escaped byte
+                    pos += 1
+                else:
+                    in_string = False
+            elif char == 0x22:  # quote
+                in_string = True
+            elif char == 0x7B:  # {
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    end = pos
+
+        if end is None or end - start > max_record_bytes:
+            if end is None and eof:
+                report.error(base + start, "truncated", "file ends inside this record")
+            else:
+                report.error(base + start, "oversize", f"record exceeds {max_record_bytes} bytes")
+            # An unclosed record swallows whatever follows it, so look for
+            # records again right after where it started
+            pos, resync = start + 1, True
+            continue
+        raw = buf[start:end]
+        try:
+            record = _parse(raw)
+        except ValueError as e:
+            report.error(base + start, "parse", _parse_error(e, base + start, raw))
+            # A record cut short inside a string runs on into the records
+            # after it; recover any that start on a later line
+            match = _RESYNC.search(buf, start + 1, end)
+            pos = match.end() - 1 if match is not None else end
+            continue
+        yield base + start, record
+        pos = end
+
+
+def validate(record):
+    # Reason the record cannot be indexed, or None
+    if not isinstance(record, dict):
+        return f"expected an object, got {type(record).__name__}"
+    data = record.get("data")
+    if not isinstance(data, dict):
+        return "missing or non-object 'data'"
+    for key in NAME_FIELDS:
+        if data.get(key) is not None and not isinstance(data[key], str):
+            return f"data.{key} must be a string"
+    for key in TEXT_FIELDS:
+        if data.get(key) is not None and not isinstance(data[key], (str, list)):
+            return f"data.{key} must be a string or a list"
+    return None
+
+
+def iter_schemes(path, report=None, read_size=READ_SIZE, max_record_bytes=MAX_RECORD_BYTES):
+    # One pass over the file; yields valid scheme records and reports every
+    # skipped one with its byte offset
+    report = report if report is not None else LoadReport(path)
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        for offset, record in _scan(f, report, read_size, max_record_bytes):
+            problem = validate(record)
+            if problem is not None:
+                report.error(offset, "invalid", problem)
+                continue
+            report.records += 1
+            yield record
+        report.bytes = f.tell()
+    report.seconds = time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check a scheme crawl and list the records that would be skipped.")
+    parser.add_argument("path", help="scheme_data.json, as one JSON array or JSON Lines")
+    parser.add_argument("--errors", help="Write every kept error as JSON Lines to this file")
+    parser.add_argument("--max-errors", type=int, default=1000, help="Errors to keep and list")
+    args = parser.parse_args(argv)
+
+    report = LoadReport(args.path, max_errors=args.max_errors)
+    for _ in iter_schemes(args.path, report):
+        pass
+    for error in report.errors[:20]:
+        print(f"  byte {error['offset']}: {error['reason']}: {error['message']}")
+    if report.error_count > 20:
+        print(f"  ... {report.error_count - 20} more")
+    if args.errors:
+        with open(args.errors, "w", encoding="utf-8") as f:
+            for error in report.errors:
+                f.write(json.dumps(error) + "\n")
+    print(report.summary())
+    return report
+
+
+if __name__ == "__main__":
+    main()
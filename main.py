@@ -1,9 +1,115 @@
+import math
+import os
+import uuid
+from collections import OrderedDict
 import streamlit as st
+from client import RemoteSchemeRAG
+from feedback import FeedbackStore, result_keys, scheme_key
+from history import HistoryStore
 from rag import GovernmentSchemeRAG
+from warmup import EXAMPLE_QUERIES, hot_questions, start_warmer
+
+# Set to a directory built with `python snapshot.py` to let several Streamlit
+# workers share one memory-mapped index instead of each building their own
+SNAPSHOT_DIR = os.getenv("RAG_SNAPSHOT_DIR")
+# Set to the URL of a running `api.py` to use the UI as a client of the API
+API_URL = os.getenv("RAG_API_URL")
+
+# Answers kept per session for questions asked again later in the same session
+ANSWER_MEMO_SIZE = 32
+# History lives in SQLite, not in session state; the sidebar shows one page
+HISTORY_DB = os.getenv("RAG_HISTORY_DB", "history.sqlite3")
+HISTORY_PAGE_SIZE = 10
 
 @st.cache_resource
 def load_rag_system(json_path, hf_token):
-    return GovernmentSchemeRAG(json_path, hf_token)
+    if API_URL and json_path == "scheme_data.json":
+        return RemoteSchemeRAG(API_URL)
+    if SNAPSHOT_DIR and json_path == "scheme_data.json" and os.path.isdir(SNAPSHOT_DIR):
+        rag_system = GovernmentSchemeRAG(json_path, hf_token, snapshot_dir=SNAPSHOT_DIR)
+    else:
+        rag_system = GovernmentSchemeRAG(json_path, hf_token)
+    # Popular and most-asked questions are warmed in the background so the
+    # first users after a restart do not pay the cold-cache latency
+    if os.getenv("RAG_WARMUP", "1") != "0":
+        start_warmer(rag_system, hot_questions(EXAMPLE_QUERIES, history_db=HISTORY_DB))
+    return rag_system
+
+@st.cache_resource
+def load_history_store(path):
+    return HistoryStore(path)
+
+@st.cache_resource
+def load_feedback_store(path):
+    return FeedbackStore(path)
+
+def record_feedback(latest, rating):
+    # Persisted for feedback.py to aggregate into the relevance boost table;
+    # each answer counts once per session however often the button is clicked
+    rated = st.session_state.setdefault("rated_entries", set())
+    if latest["id"] in rated:
+        return False
+    load_feedback_store(HISTORY_DB).add(latest["question"], [r["id"] for r in latest["sources"]], latest["answer"],
+                                        rating, ministry=latest.get("ministry"), session_id=get_session_id(),
+                                        entry_id=latest["id"],
+                                        scheme_keys=[scheme_key(r["metadata"]) for r in latest["sources"]])
+    rated.add(latest["id"])
+    return True
+
+def get_session_id():
+    # Kept in the URL so a page reload resumes the same history
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = st.query_params.get("session") or uuid.uuid4().hex
+        st.query_params["session"] = st.session_state.session_id
+    return st.session_state.session_id
+
+def sources_from_ids(rag_system, source_ids, source_keys=None):
+    # History stores chunk ids and scheme keys; ids change whenever the corpus
+    # is re-indexed, so entries with keys are looked up by key. The version is
+    # read first: a reload in between only makes the ids look stale.
+    version = rag_system.version
+    metadata = rag_system.metadata
+    if source_keys is None:
+        return [{"id": i, "metadata": metadata[i], "version": version} for i in source_ids if 0 <= i < len(metadata)]
+    wanted = set(source_keys)
+    found = {}
+    for i, meta in enumerate(metadata):
+        for key in result_keys(meta):
+            if key in wanted:
+                found.setdefault(key, i)
+    ids = list(dict.fromkeys(found[key] for key in source_keys if key in found))
+    return [{"id": i, "metadata": metadata[i], "version": version} for i in ids]
+
+def source_markdown(rag_system, result):
+    # Result ids only hold for the index version they came from; after a
+    # reload the scheme is found again by its key
+    markdown = rag_system.render_card(result["id"], version=result.get("version"))
+    if markdown is None:
+        current = sources_from_ids(rag_system, [], [scheme_key(result["metadata"])])
+        if current:
+            markdown = rag_system.render_card(current[0]["id"], version=current[0]["version"])
+    return markdown or result.get("chunk") or "_This scheme is no longer in the index._"
+
+def answer_once(rag_system, question, ministry):
+    # Streamlit reruns main() top to bottom on every click (feedback, theme
+    # toggle, filters). Only a new (question, filter) pair runs retrieval and
+    # generation; a rerun with unchanged inputs returns None and adds nothing.
+    key = (id(rag_system), question.strip(), ministry)
+    if st.session_state.get("last_request_key") == key:
+        return None
+    memo = st.session_state.setdefault("answer_memo", OrderedDict())
+    response = memo.get(key)
+    if response is None:
+        with st.spinner("🤔 Thinking..."):
+            response = rag_system.answer(question, top_k=3, ministry=ministry)
+        if not response.get("degraded"):  # retry shed requests next time
+            memo[key] = response
+            while len(memo) > ANSWER_MEMO_SIZE:
+                memo.popitem(last=False)
+    else:
+        memo.move_to_end(key)
+    st.session_state.last_request_key = key
+    return response
 
 def main():
     # Set page configuration
@@ -45,54 +151,55 @@ def main():
             """
             st.components.v1.html(f"<script>{js_code}</script>", height=0)
 
-        # History view
+        # History view, one page at a time
         st.markdown("---")
         st.subheader("📜 History")
-        if "history" not in st.session_state:
-            st.session_state.history = []
-        for entry in reversed(st.session_state.history):
+        history = load_history_store(HISTORY_DB)
+        session_id = get_session_id()
+        pages = max(1, math.ceil(history.count(session_id) / HISTORY_PAGE_SIZE))
+        page = st.number_input("Page", min_value=1, max_value=pages, value=1, step=1) if pages > 1 else 1
+        for entry in history.page(session_id, page - 1, HISTORY_PAGE_SIZE):
             with st.expander(f"❓ {entry['question'][:40]}..."):
                 st.markdown(f"💬 **Answer:** {entry['answer'][:300]}{'...' if len(entry['answer']) > 300 else ''}")
 
     # Load RAG system only after API key is provided
     rag_system = load_rag_system(st.session_state.json_path, hf_token)
-    st.success(f"✅ Loaded {len(rag_system.chunks)} chunks from {len(rag_system.metadata)} schemes.")
+    st.success(f"✅ Loaded {len(rag_system.metadata)} schemes.")
 
     # Example input section
     st.subheader("💡 Ask Your Question")
-    example_queries = [
-        "What schemes are available for women entrepreneurs?",
-        "Schemes related to education for girls?",
-        "Financial assistance for farmers?",
-        "Startup schemes in India?"
-    ]
+    example_queries = EXAMPLE_QUERIES
 
     selected_example = st.selectbox("📌 Popular Queries:", [""] + example_queries)
     user_query = st.text_input("🔍 Type your question here:", value=selected_example)
 
     # Filter by ministry
-    all_ministries = sorted(set([meta.get("ministry", "Unknown") for meta in rag_system.metadata]))
+    all_ministries = rag_system.ministries()
     selected_ministry = st.selectbox("🏛️ Filter by Ministry", ["All"] + all_ministries)
 
     # Process query
-    if user_query.strip():
-        with st.spinner("🤔 Thinking..."):
-            results = rag_system.query(user_query, top_k=3)
-            if selected_ministry != "All":
-                results = [r for r in results if r["metadata"].get("ministry") == selected_ministry]
-            context = "\n\n".join([r["chunk"] for r in results])
-            generated_answer = rag_system.generate_answer(user_query, context)
-
-        # Save to history
-        st.session_state.history.append({
+    response = answer_once(rag_system, user_query, selected_ministry) if user_query.strip() else None
+    if response is not None:
+        # Save to history; only the latest answer is kept in session state
+        entry_id = history.add(session_id, user_query, response["answer"], [r["id"] for r in response["sources"]],
+                               ministry=selected_ministry,
+                               source_keys=[scheme_key(r["metadata"]) for r in response["sources"]])
+        st.session_state.latest = {
+            "id": entry_id,
             "question": user_query,
-            "answer": generated_answer,
-            "sources": results
-        })
+            "ministry": selected_ministry,
+            "answer": response["answer"],
+            "sources": response["sources"]
+        }
+    elif "latest" not in st.session_state:
+        # Resuming a session after a reload
+        entry = history.latest(session_id)
+        if entry is not None:
+            st.session_state.latest = dict(entry, sources=sources_from_ids(rag_system, entry["source_ids"], entry["source_keys"]))
 
     # Show latest answer
-    if st.session_state.history:
-        latest = st.session_state.history[-1]
+    latest = st.session_state.get("latest")
+    if latest:
         st.subheader("🧠 Answer")
         st.write(latest["answer"])
 
@@ -100,9 +207,11 @@ def main():
         col1, col2 = st.columns(2)
         with col1:
             if st.button("👍 Helpful", key="like"):
+                record_feedback(latest, 1)
                 st.success("Thanks for your feedback!")
         with col2:
             if st.button("👎 Not helpful", key="dislike"):
+                record_feedback(latest, -1)
                 st.warning("We’ll use this to improve.")
 
         # Sources
@@ -111,12 +220,21 @@ def main():
             meta = result["metadata"]
             title = f"{meta.get('scheme_name', 'Unknown')} — {meta.get('ministry', '')}"
             with st.expander(f"Source {idx}: {title}"):
-                st.markdown(result["chunk"])
+                # Precomputed scheme card; falls back to the raw chunk text
+                st.markdown(source_markdown(rag_system, result))
+                if meta.get("variants"):
+                    names = ", ".join(f"{v.get('scheme_name', 'Unknown')} ({v.get('ministry', '')})" for v in meta["variants"])
+                    st.caption(f"Also published as: {names}")
+                if result.get("evidence"):
+                    st.markdown("**🔎 Matched evidence:**")
+                    for span in result["evidence"]:
+                        st.markdown(f"> {span['text']}")
 
     # Show previous history
-    if len(st.session_state.history) > 1:
+    previous = [entry for entry in history.page(session_id, 0, HISTORY_PAGE_SIZE) if latest and entry["id"] != latest["id"]]
+    if previous:
         with st.expander("📜 Previous Questions"):
-            for entry in reversed(st.session_state.history[:-1]):
+            for entry in previous:
                 st.markdown(f"**❓ Q:** {entry['question']}")
                 st.markdown(f"**💡 A:** {entry['answer']}")
                 st.markdown("---")
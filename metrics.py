@@ -0,0 +1,264 @@
+### Per-stage latency metrics and request traces
+import contextvars
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+trace_logger = logging.getLogger("rag.trace")
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _escape(value):
+    # Prometheus text format: backslash, double quote and newline are escaped
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self.lock:
+            return self.values.get(_label_key(labels), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+    def snapshot(self):
+        with self.lock:
+            return {_format_labels(key) or "{}": value for key, value in self.values.items()}
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        self.series = {}  # label key -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def count(self, **labels):
+        with self.lock:
+            series = self.series.get(_label_key(labels))
+            return sum(series[:-1]) if series else 0
+
+    def quantile(self, q, **labels):
+        # Estimated from bucket counts like Prometheus' histogram_quantile
+        with self.lock:
+            series = self.series.get(_label_key(labels))
+            if not series:
+                return None
+            counts = series[:-1]
+        total = sum(counts)
+        if total == 0:
+            return None
+        rank = q * total
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, counts):
+            if count and seen + count >= rank:
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.buckets[-1]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, series in sorted(self.series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                cumulative += series[len(self.buckets)]
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series[-1]}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+    def snapshot(self):
+        with self.lock:
+            keys = list(self.series)
+        result = {}
+        for key in keys:
+            labels = dict(key)
+            result[_format_labels(key) or "{}"] = {
+                "count": self.count(**labels),
+                "p50": self.quantile(0.5, **labels),
+                "p95": self.quantile(0.95, **labels),
+                "p99": self.quantile(0.99, **labels),
+            }
+        return result
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def _get_or_create(self, cls, name, help_text, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help_text, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} already registered as {type(metric).__name__}")
+            return metric
+
+    def counter(self, name, help_text):
+        return self._get_or_create(Counter, name, help_text)
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help_text, buckets=buckets)
+
+    def render(self):
+        # Prometheus text exposition format
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        with self.lock:
+            metrics = list(self.metrics.items())
+        return {name: metric.snapshot() for name, metric in metrics}
+
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.histogram("rag_stage_seconds", "Latency of each pipeline stage in seconds.")
+STAGE_ERRORS = REGISTRY.counter("rag_stage_errors_total", "Exceptions raised inside a pipeline stage.")
+REQUEST_SECONDS = REGISTRY.histogram("rag_request_seconds", "End-to-end latency of traced requests in seconds.")
+# Trace kinds whose stages stay out of rag_stage_seconds, so cache warm-up
+# after a deploy does not skew the live stage percentiles
+UNTIMED_KINDS = frozenset({"warmup"})
+
+_current_trace = contextvars.ContextVar("rag_trace", default=None)
+_trace_sinks = []
+
+
+def add_trace_sink(sink):
+    # sink(record) is called with every finished trace's record on the request
+    # thread, so it must only hand the record off (e.g. to a queue)
+    if sink not in _trace_sinks:
+        _trace_sinks.append(sink)
+
+
+def remove_trace_sink(sink):
+    if sink in _trace_sinks:
+        _trace_sinks.remove(sink)
+
+
+class Trace:
+    def __init__(self, kind, fields):
+        self.trace_id = uuid.uuid4().hex
+        self.kind = kind
+        self.fields = fields
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def add(self, stage, elapsed):
+        with self.lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + elapsed
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        trace = _current_trace.get()
+        if trace is None or trace.kind not in UNTIMED_KINDS:
+            STAGE_SECONDS.observe(elapsed, stage=stage)
+        if trace is not None:
+            trace.add(stage, elapsed)
+
+
+@contextmanager
+def trace(kind, **fields):
+    # Nested calls (answer -> query) join the outermost trace
+    if _current_trace.get() is not None:
+        yield _current_trace.get()
+        return
+    current = Trace(kind, fields)
+    token = _current_trace.set(current)
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield current
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        _current_trace.reset(token)
+        REQUEST_SECONDS.observe(elapsed, kind=kind)
+        logging_enabled = trace_logger.isEnabledFor(logging.INFO)
+        if logging_enabled or _trace_sinks:
+            record = {
+                "trace_id": current.trace_id,
+                "ts": round(time.time(), 3),
+                "kind": kind,
+                "status": status,
+                "total_ms": round(elapsed * 1000, 3),
+                "stages_ms": {k: round(v * 1000, 3) for k, v in current.stages.items()},
+                **current.fields,
+            }
+            if logging_enabled:
+                trace_logger.info(json.dumps(record, default=str))
+            for sink in list(_trace_sinks):
+                try:
+                    sink(record)
+                except Exception as e:
+                    print(f"Warning: trace sink failed: {e}")
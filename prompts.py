@@ -0,0 +1,173 @@
+### Named prompt templates, compiled once, with token accounting
+# python prompts.py            -> fixed-part token counts for every template
+import hashlib
+import os
+import re
+import string
+from functools import lru_cache
+
+DEFAULT_TOKENIZER = "google/flan-t5-small"
+
+
+class PromptTemplate:
+    # Parsed once into literal segments and field names, so rendering is a
+    # single join instead of re-parsing a format string per request.
+    def __init__(self, name, text):
+        self.name = name
+        self.text = text
+        self.segments = []
+        self.fields = []
+        for literal, field, spec, conversion in string.Formatter().parse(text):
+            if spec or conversion:
+                raise ValueError(f"Template {name}: format specs are not supported ({{{field}}})")
+            if literal:
+                self.segments.append((literal, None))
+            if field is not None:
+                if not field:
+                    raise ValueError(f"Template {name}: positional fields are not supported")
+                self.segments.append((None, field))
+                self.fields.append(field)
+        self.static_text = "".join(literal for literal, _ in self.segments if literal)
+        # Everything before the first field is identical for every request and
+        # can be reused by backends that cache prompt prefixes
+        self.static_prefix = ""
+        for literal, field in self.segments:
+            if field is not None:
+                break
+            self.static_prefix += literal
+
+    def render(self, **values):
+        missing = [f for f in self.fields if f not in values]
+        if missing:
+            raise KeyError(f"Template {self.name} is missing values for: {', '.join(missing)}")
+        return "".join(literal if field is None else str(values[field]) for literal, field in self.segments)
+
+    def token_counts(self, tokenizer_name=DEFAULT_TOKENIZER):
+        return {
+            "static": count_tokens(self.static_text, tokenizer_name),
+            "static_prefix": count_tokens(self.static_prefix, tokenizer_name),
+        }
+
+
+@lru_cache(maxsize=None)
+def load_tokenizer(tokenizer_name):
+    try:
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(tokenizer_name)
+    except Exception as e:
+        print(f"Warning: could not load tokenizer {tokenizer_name} ({e}); using an approximate count.")
+        return None
+
+
+def count_tokens(text, tokenizer_name=DEFAULT_TOKENIZER):
+    tokenizer = load_tokenizer(tokenizer_name) if tokenizer_name else None
+    if tokenizer is None:
+        # Rough word/punctuation count when no tokenizer is available
+        return len(re.findall(r"\w+|[^\w\s]", text))
+    return len(tokenizer.encode(text, add_special_tokens=False))
+
+
+_LEGACY_PROMPT = """
+Context about government schemes:
+{context}
+
+Question: {question}
+
+Given the context below about a government scheme, answer the user's question concisely, focusing on the key details requested.
+
+If available, mention:
+- Scheme Name
+- Purpose
+- Eligibility
+- Key Benefits
+- Application Process Overview (briefly)
+- Website Link (if explicitly found in context)
+
+Highlight important section titles in **bold**.
+If information is missing for a section, simply omit that section. Be clear and direct.
+"""
+
+# Same instructions with the static part first and the per-request context
+# last, so consecutive prompts share the longest possible prefix.
+_INSTRUCTIONS_FIRST_PROMPT = """Answer the user's question about a government scheme concisely, using only the context at the end, focusing on the key details requested.
+
+If available, mention:
+- Scheme Name
+- Purpose
+- Eligibility
+- Key Benefits
+- Application Process Overview (briefly)
+- Website Link (if explicitly found in context)
+
+Highlight important section titles in **bold**.
+If information is missing for a section, simply omit that section. Be clear and direct.
+
+Question: {question}
+
+Context about government schemes:
+{context}
+"""
+
+_CONCISE_PROMPT = """Answer briefly using only the context. Mention Scheme Name, Eligibility, Key Benefits and Website Link when present, with section titles in **bold**.
+
+Question: {question}
+
+Context:
+{context}
+"""
+
+TEMPLATES = {}
+
+
+def register_template(name, text):
+    TEMPLATES[name] = PromptTemplate(name, text)
+    return TEMPLATES[name]
+
+
+def get_template(name):
+    try:
+        return TEMPLATES[name]
+    except KeyError:
+        raise ValueError(f"Unknown prompt template '{name}'. Available: {', '.join(sorted(TEMPLATES))}") from None
+
+
+register_template("legacy", _LEGACY_PROMPT)
+register_template("instructions_first", _INSTRUCTIONS_FIRST_PROMPT)
+register_template("concise", _CONCISE_PROMPT)
+
+DEFAULT_TEMPLATE = os.getenv("RAG_PROMPT_TEMPLATE", "legacy")
+
+
+def parse_ab_weights(spec):
+    # "legacy:50,instructions_first:50" -> {"legacy": 50.0, "instructions_first": 50.0}
+    weights = {}
+    for part in (spec or "").split(","):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition(":")
+        weights[name.strip()] = float(weight) if weight else 1.0
+    return weights
+
+
+def choose_template(question, default=None, ab_weights=None):
+    # A/B assignment is a stable hash of the question, so a repeated question
+    # always gets the same prompt (and stays cacheable)
+    if not ab_weights:
+        return get_template(default or DEFAULT_TEMPLATE)
+    total = sum(ab_weights.values())
+    if total <= 0:
+        return get_template(default or DEFAULT_TEMPLATE)
+    bucket = int(hashlib.sha1(question.encode("utf-8")).hexdigest()[:8], 16) / 0xFFFFFFFF * total
+    for name, weight in ab_weights.items():
+        bucket -= weight
+        if bucket <= 0:
+            return get_template(name)
+    return get_template(list(ab_weights)[-1])
+
+
+if __name__ == "__main__":
+    import sys
+    tokenizer_name = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_TOKENIZER
+    for name, template in sorted(TEMPLATES.items()):
+        counts = template.token_counts(tokenizer_name)
+        print(f"{name}: {counts['static']} fixed tokens ({counts['static_prefix']} in the cacheable prefix)")
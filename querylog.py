@@ -0,0 +1,336 @@
+### Append-only, rotating, compressed JSON Lines query log and its offline analytics
+# RAG_QUERY_LOG_DIR=query_logs/ enables logging in the UI and API; then
+# python querylog.py query_logs/ --top 20
+import argparse
+import atexit
+import glob
+import gzip
+import io
+import json
+import os
+import queue
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from metrics import REGISTRY, add_trace_sink, remove_trace_sink
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+_TRUNCATED = (EOFError, OSError) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+QUERY_LOG_RECORDS = REGISTRY.counter("rag_query_log_records_total", "Traces handed to the query log, by outcome.")
+# Retrieval and answer traces; startup warm-up runs under its own "warmup" trace
+LOGGED_KINDS = ("query", "answer", "query_batch", "answer_batch")
+SEGMENT_PREFIX = "queries-"
+CACHE_SIZES = (64, 256, 1024, 4096)
+
+_default_log = None
+_default_lock = threading.Lock()
+
+
+def _open_segment(path, compression):
+    raw = open(path, "xb")
+    if compression == "zstd":
+        return raw, zstandard.ZstdCompressor(level=3).stream_writer(raw)
+    return raw, gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6)
+
+
+class QueryLog:
+    # Request threads only enqueue; one daemon thread serialises, compresses
+    # and rotates. A full queue drops the record rather than block a request.
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024, max_age=3600.0, keep=168, compression=None,
+                 flush_interval=5.0, max_queue=10000):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.keep = keep
+        if compression is None:
+            compression = "zstd" if zstandard is not None else "gzip"
+        if compression == "zstd" and zstandard is None:
+            print("Warning: zstandard is not installed; writing the query log with gzip.")
+            compression = "gzip"
+        if compression not in ("zstd", "gzip"):
+            raise ValueError(f"Unknown query log compression {compression!r}; expected zstd or gzip.")
+        self.compression = compression
+        self.suffix = ".jsonl.zst" if compression == "zstd" else ".jsonl.gz"
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.written = 0
+        self._raw = self._stream = None
+        self._segment_bytes = 0
+        self._segment_opened = 0.0
+        self._sequence = 0
+        self._closed = False
+        os.makedirs(directory, exist_ok=True)
+        self.thread = threading.Thread(target=self._run, name="rag-query-log", daemon=True)
+        self.thread.start()
+
+    def record(self, record):
+        if record.get("kind") not in LOGGED_KINDS or self._closed:
+            return
+        try:
+            self.queue.put_nowait(record)
+            QUERY_LOG_RECORDS.inc(outcome="queued")
+        except queue.Full:
+            self.dropped += 1
+            QUERY_LOG_RECORDS.inc(outcome="dropped")
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                record = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                record = False
+            if record is None:
+                break
+            if record:
+                try:
+                    self._write(record)
+                except Exception as e:
+                    print(f"Warning: could not write query log record: {e}")
+            if self._stream is not None and time.monotonic() - last_flush >= self.flush_interval:
+                self._flush()
+                last_flush = time.monotonic()
+            if self._stream is not None and time.time() - self._segment_opened >= self.max_age:
+                self._rotate()
+        self._rotate()
+
+    def _write(self, record):
+        if self._stream is None:
+            self._open()
+        line = (json.dumps(record, default=str, ensure_ascii=False) + "\n").encode("utf-8")
+        self._stream.write(line)
+        self._segment_bytes += len(line)
+        self.written += 1
+        if self._segment_bytes >= self.max_bytes:
+            self._rotate()
+
+    def _open(self):
+        # One writer per process: the pid keeps API workers out of each other's files
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+        self._sequence += 1
+        path = os.path.join(self.directory, f"{SEGMENT_PREFIX}{stamp}-{os.getpid()}-{self._sequence}{self.suffix}")
+        self._raw, self._stream = _open_segment(path, self.compression)
+        self._segment_bytes = 0
+        self._segment_opened = time.time()
+
+    def _flush(self):
+        # Completes a compressed block so a crash loses at most flush_interval of records
+        if self.compression == "zstd":
+            self._stream.flush(zstandard.FLUSH_FRAME)
+        else:
+            self._stream.flush()
+        self._raw.flush()
+
+    def _rotate(self):
+        if self._stream is None:
+            return
+        self._stream.close()
+        if not self._raw.closed:
+            self._raw.close()
+        self._raw = self._stream = None
+        self._prune()
+
+    def _prune(self):
+        segments = sorted(segment_paths(self.directory), key=os.path.getmtime)
+        for path in segments[:max(0, len(segments) - self.keep)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # another worker pruned it first
+
+    def close(self, timeout=10.0):
+        if self._closed:
+            return
+        self._closed = True
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+
+def default_query_log():
+    # One writer per process, fed by every trace, when RAG_QUERY_LOG_DIR is set
+    global _default_log
+    directory = os.getenv("RAG_QUERY_LOG_DIR")
+    if not directory:
+        return None
+    with _default_lock:
+        if _default_log is None:
+            _default_log = QueryLog(directory, max_bytes=int(os.getenv("RAG_QUERY_LOG_MAX_MB", "64")) * 1024 * 1024,
+                                    max_age=float(os.getenv("RAG_QUERY_LOG_MAX_AGE", "3600")),
+                                    keep=int(os.getenv("RAG_QUERY_LOG_KEEP", "168")),
+                                    compression=os.getenv("RAG_QUERY_LOG_COMPRESSION") or None)
+            add_trace_sink(_default_log.record)
+            atexit.register(close_default_query_log)
+        return _default_log
+
+
+def close_default_query_log():
+    global _default_log
+    with _default_lock:
+        if _default_log is not None:
+            remove_trace_sink(_default_log.record)
+            _default_log.close()
+            _default_log = None
+
+
+def segment_paths(directory):
+    return sorted(glob.glob(os.path.join(directory, SEGMENT_PREFIX + "*.jsonl.zst")) +
+                  glob.glob(os.path.join(directory, SEGMENT_PREFIX + "*.jsonl.gz")))
+
+
+def _read_segment(path):
+    # Streams one segment; the one still being written (or cut short by a
+    # crash) ends at its last completed block instead of raising
+    raw = open(path, "rb")
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raw.close()
+            raise ValueError(f"{path} is zstd-compressed; install zstandard to read it.")
+        stream = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+    else:
+        stream = gzip.GzipFile(fileobj=raw, mode="rb")
+    with raw, stream:
+        try:
+            for line in io.TextIOWrapper(stream, encoding="utf-8", errors="replace"):
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # partial last line of an unfinished block
+        except _TRUNCATED:
+            return
+
+
+def read_log(directory, since=None):
+    for path in segment_paths(directory):
+        if since is not None and os.path.getmtime(path) < since:
+            continue
+        for record in _read_segment(path):
+            if since is None or record.get("ts", 0) >= since:
+                yield record
+
+
+def _questions(record):
+    # (question, ids, scores) per question a record covers
+    if "questions" in record:
+        return zip(record["questions"], record.get("ids") or [[]] * len(record["questions"]),
+                   record.get("scores") or [[]] * len(record["questions"]))
+    if "question" in record:
+        return [(record["question"], record.get("ids", []), record.get("scores", []))]
+    return []
+
+
+def _percentiles(values):
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def pick(p):
+        return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+    return {"count": len(values), "p50": pick(50), "p95": pick(95), "p99": pick(99), "max": values[-1]}
+
+
+def _lru_hit_rates(keys, sizes=CACHE_SIZES):
+    # Replays the question stream against LRU caches of each size
+    rates = {}
+    for size in sizes:
+        cache, hits = OrderedDict(), 0
+        for key in keys:
+            if key in cache:
+                hits += 1
+                cache.move_to_end(key)
+            else:
+                cache[key] = None
+                if len(cache) > size:
+                    cache.popitem(last=False)
+        rates[size] = round(hits / len(keys), 4) if keys else 0.0
+    return rates
+
+
+def analyze(records, top=20):
+    counts, display, keys = Counter(), {}, []
+    zero, questions, errors, total = 0, 0, 0, 0
+    latency, stages, modes, ministries = {}, {}, Counter(), Counter()
+    top_scores = []
+    for record in records:
+        total += 1
+        errors += record.get("status") == "error"
+        latency.setdefault(record.get("kind"), []).append(record.get("total_ms", 0.0))
+        for stage, ms in (record.get("stages_ms") or {}).items():
+            stages.setdefault(stage, []).append(ms)
+        if record.get("mode"):
+            modes[record["mode"]] += 1
+        if record.get("ministry"):
+            ministries[record["ministry"]] += 1
+        for question, ids, scores in _questions(record):
+            key = " ".join(question.lower().split())
+            counts[key] += 1
+            display.setdefault(key, question)
+            keys.append(key)
+            questions += 1
+            zero += not ids
+            if scores:
+                top_scores.append(scores[0])
+    return {
+        "records": total,
+        "errors": errors,
+        "questions": questions,
+        "distinct_questions": len(counts),
+        "zero_result_rate": round(zero / questions, 4) if questions else 0.0,
+        "top_queries": [(display[key], n) for key, n in counts.most_common(top)],
+        "latency_ms": {kind: _percentiles(values) for kind, values in latency.items()},
+        "stage_ms": {stage: _percentiles(values) for stage, values in sorted(stages.items())},
+        "top_score": _percentiles(top_scores),
+        "answer_modes": dict(modes),
+        "ministry_filters": dict(ministries.most_common(top)),
+        "lru_hit_rate": _lru_hit_rates(keys),
+    }
+
+
+def _print_report(report):
+    print(f"{report['records']} traces ({report['errors']} errors), {report['questions']} questions, "
+          f"{report['distinct_questions']} distinct, zero-result rate {report['zero_result_rate']:.2%}")
+    print("\nTop queries:")
+    for question, n in report["top_queries"]:
+        print(f"  {n:6d}  {question}")
+    print("\nLatency (ms):")
+    for name, stats in list(report["latency_ms"].items()) + [(f"  {k}", v) for k, v in report["stage_ms"].items()]:
+        print(f"  {name:<20} n={stats['count']:<7} p50={stats['p50']:<10.2f} p95={stats['p95']:<10.2f} "
+              f"p99={stats['p99']:<10.2f} max={stats['max']:.2f}")
+    if report["top_score"]:
+        print(f"\nBest L2 distance per question: p50={report['top_score']['p50']:.3f} "
+              f"p95={report['top_score']['p95']:.3f}")
+    if report["answer_modes"]:
+        print(f"\nAnswer modes: {report['answer_modes']}")
+    if report["ministry_filters"]:
+        print(f"Ministry filters: {report['ministry_filters']}")
+    print("\nHit rate of an LRU cache keyed on the normalised question, by size:")
+    for size, rate in report["lru_hit_rate"].items():
+        print(f"  {size:6d}  {rate:.2%}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarise the query log written with RAG_QUERY_LOG_DIR.")
+    parser.add_argument("directory", help="Query log directory")
+    parser.add_argument("--top", type=int, default=20, help="Number of top queries to list")
+    parser.add_argument("--hours", type=float, help="Only records from the last N hours")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    since = time.time() - args.hours * 3600 if args.hours else None
+    report = analyze(read_log(args.directory, since), top=args.top)
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        _print_report(report)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -1,80 +1,342 @@
 ### APi key input 
-import json
+import contextvars
+import copy
+import os
+import threading
+import time
 import numpy as np
 import faiss
 import requests
-from sentence_transformers import SentenceTransformer
-import re
+from concurrent.futures import ThreadPoolExecutor
+from cache import LRUCache
+from cards import build_card, render_card
+from dedup import collapse, summary as dedup_summary
+from encoders import DEFAULT_BACKEND, EmbeddingCache, encode_batched, load_encoder, resolve_model_name
+from extractive import SentenceIndex, extract_answer, format_extractive
+from feedback import BoostTable, result_keys
+from formatting import NO_MATCHES, format_answer, format_retrieval_only
+from hotswap import IndexState, IndexWatcher, source_signature
+from loader import LoadReport, iter_schemes
+from metrics import REGISTRY, current_trace, timed, trace
+from prompts import DEFAULT_TEMPLATE, choose_template, get_template, parse_ab_weights
+from querylog import default_query_log
+from ratelimit import Overloaded, default_admission_controller
+from runtime import configure_threads
+from shards import ShardedIndex
+from singleflight import SingleFlight
+from snapshot import INDEX_FILE, list_ministries, load_cards, load_sentence_index, load_snapshot, save_snapshot
+
+PROMPT_TEMPLATE_USES = REGISTRY.counter("rag_prompt_template_total", "Prompts rendered, by template name.")
+ANSWER_MODES = ("llm", "extractive", "auto")
+ANSWERS_BY_MODE = REGISTRY.counter("rag_answers_total", "Answers returned, by the mode that produced them.")
+
+BOOST_CANDIDATES = 5
+# Upper bound on one generation HTTP call; a request deadline shortens it
+GENERATION_TIMEOUT = float(os.getenv("RAG_GEN_HTTP_TIMEOUT", "30"))
+
+
+def _note_results(question, results):
+    # Question, ids and scores on the current trace, for the query log
+    trace = current_trace()
+    if trace is not None:
+        trace.fields.update(question=question, ids=[r["id"] for r in results],
+                            scores=[round(r["score"], 4) for r in results])
+
+
+def _note_batch(questions, all_results):
+    trace = current_trace()
+    if trace is not None:
+        trace.fields.update(questions=list(questions), ids=[[r["id"] for r in results] for results in all_results],
+                            scores=[[round(r["score"], 4) for r in results] for results in all_results])
+
+
+def _answer_key(version, question, top_k, ministry):
+    return version, " ".join(question.lower().split()), top_k, ministry or "All"
+
+
+def _in_ministry(result, ministry):
+    # Near-duplicates collapsed at ingest (dedup.py) keep their own ministries as variants
+    meta = result["metadata"]
+    return meta.get("ministry") == ministry or any(v.get("ministry") == ministry for v in meta.get("variants", ()))
+
+
+def _close_after_grace(index):
+    # Shard workers stay up until requests still holding their state are done
+    if hasattr(index, "close"):
+        grace = threading.Timer(float(os.getenv("RAG_RELOAD_GRACE", "60")), index.close)
+        grace.daemon = True
+        grace.start()
+
+
+def _state_attribute(name):
+    # rag.index, rag.chunks, ... read and write the live IndexState, so the
+    # builders and callers that use one attribute at a time keep working
+    return property(lambda self: getattr(self.state, name), lambda self, value: setattr(self.state, name, value))
+
+
+def _retry_after(response, default=5.0):
+    try:
+        return float(response.headers.get("Retry-After", default))
+    except (TypeError, ValueError):
+        return default
 
 class GovernmentSchemeRAG:
-    def __init__(self, json_path, hf_token=""):
+    index = _state_attribute("index")
+    dimension = _state_attribute("dimension")
+    chunks = _state_attribute("chunks")
+    metadata = _state_attribute("metadata")
+    cards = _state_attribute("cards")
+    sentence_index = _state_attribute("sentence_index")
+    # Build the result ids of the live index belong to; results carry their own
+    version = property(lambda self: self.state.version)
+
+    def __init__(self, json_path, hf_token="", snapshot_dir=None, prompt_template=None, prompt_ab=None,
+                 admission=None, answer_mode=None, extractive_threshold=None, model_name=None, multilingual=None,
+                 embedding_cache_dir=None, encoder_backend=None, encoder_threads=None, threads=None, pin_cores=None,
+                 boost_table=None, query_embeddings=None, shards=None, reload_interval=None,
+                 dedup_threshold=None):
         self.json_path = json_path
-        self.embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
-        self.index = None
-        self.dimension = None
+        # Size torch, FAISS, ONNX Runtime and tokenizer pools together (RAG_THREADS)
+        # and optionally pin this worker to cores (RAG_PIN_CORES="0-3" or "auto")
+        # before any model is loaded, so multiple workers do not oversubscribe
+        self.runtime = configure_threads(threads, pin_cores)
+        # multilingual=True (or RAG_MULTILINGUAL=1) indexes with a multilingual
+        # model so questions in Hindi and other Indian languages match English text
+        if multilingual is None:
+            multilingual = os.getenv("RAG_MULTILINGUAL", "").lower() in ("1", "true", "yes")
+        self.model_name = resolve_model_name(model_name, multilingual)
+        # "onnx" / "onnx-int8" (or RAG_ENCODER_BACKEND) run the same model through
+        # ONNX Runtime, which is several times faster per query on CPU-only hosts
+        self.encoder_backend = encoder_backend or DEFAULT_BACKEND
+        self.embedding_model = load_encoder(self.model_name, self.encoder_backend, threads=encoder_threads)
+        embedding_cache_dir = embedding_cache_dir or os.getenv("RAG_EMBEDDING_CACHE_DIR")
+        cache_key = self.model_name if self.encoder_backend == "torch" else f"{self.model_name}:{self.encoder_backend}"
+        # One cache file per corpus for chunks and one for sentences, so
+        # building one never prunes the other's entries
+        self.embedding_cache = self.sentence_cache = None
+        if embedding_cache_dir:
+            scope = os.path.abspath(json_path)
+            self.embedding_cache = EmbeddingCache(embedding_cache_dir, cache_key, scope)
+            self.sentence_cache = EmbeddingCache(embedding_cache_dir, cache_key, f"sentences\0{scope}")
+        self.state = IndexState()
 
         # API Key provided via parameter (from Streamlit input)
         self.hf_token = hf_token
 
-        self.chunks, self.metadata = self.chunk_documents()
-        if not self.chunks:
-            raise ValueError("No chunks available to create embeddings.")
-
-        self.create_index()
+        # Named prompt template, or weights such as "legacy:50,concise:50" to
+        # A/B templates (both also configurable via environment variables)
+        self.prompt_template = get_template(prompt_template or DEFAULT_TEMPLATE).name
+        self.prompt_ab = parse_ab_weights(prompt_ab if prompt_ab is not None else os.getenv("RAG_PROMPT_AB"))
+        for name in self.prompt_ab:
+            get_template(name)
+
+        # Identical questions arriving at the same moment share one retrieval
+        # and one generation call instead of each hitting the model and the API
+        self._query_flight = SingleFlight("query")
+        self._generate_flight = SingleFlight("generate")
+
+        # Token buckets (global and per API key) in front of the Hugging Face
+        # endpoint; shared by every instance in the process unless overridden
+        self.admission = admission or default_admission_controller()
+
+        # "extractive" answers from the retrieved chunks' own sentences without
+        # calling the LLM; "auto" does so only when the best sentence is a
+        # confident match and falls back to the LLM otherwise
+        self.answer_mode = answer_mode or os.getenv("RAG_ANSWER_MODE", "llm")
+        if self.answer_mode not in ANSWER_MODES:
+            raise ValueError(f"Unknown answer mode {self.answer_mode!r}; expected one of {', '.join(ANSWER_MODES)}.")
+        self.extractive_threshold = float(extractive_threshold if extractive_threshold is not None
+                                          else os.getenv("RAG_EXTRACTIVE_THRESHOLD", "0.6"))
+        # Instances with the same model may share one cache (see corpora.py)
+        self.query_embeddings = (query_embeddings if query_embeddings is not None
+                                 else LRUCache(int(os.getenv("RAG_QUERY_EMBEDDING_CACHE", "1024"))))
+        self.retrieval_cache = LRUCache(int(os.getenv("RAG_RETRIEVAL_CACHE", "1024")))
+        self.answer_cache = LRUCache(int(os.getenv("RAG_ANSWER_CACHE", "256")))
+        # Every traced query and answer to rotating compressed files when
+        # RAG_QUERY_LOG_DIR is set; summarise them with querylog.py
+        self.query_log = default_query_log()
+
+        # Relevance boosts aggregated offline from UI feedback (feedback.py);
+        # applied as a re-scoring of a few extra FAISS candidates
+        self.boost_table = None
+        self.boost_weight = float(os.getenv("RAG_BOOST_WEIGHT", "0.3"))
+        boost_table = boost_table or os.getenv("RAG_BOOST_TABLE")
+        if boost_table and os.path.exists(boost_table):
+            try:
+                self.boost_table = BoostTable.load(boost_table)
+            except ValueError as e:
+                print(f"Warning: ignoring boost table: {e}")
+            if self.boost_table is not None and self.boost_table.model not in (None, self.model_name):
+                print(f"Warning: ignoring boost table {boost_table} built with {self.boost_table.model}.")
+                self.boost_table = None
+
+        # Worker processes share one read-only, memory-mapped snapshot instead
+        # of each re-chunking and re-embedding the JSON
+        self.snapshot_dir = snapshot_dir
+        # RAG_DEDUP_THRESHOLD=0.8 folds near-duplicate records (state variants,
+        # re-published pages) into one indexed chunk at ingest; 0 keeps them all
+        self.dedup_threshold = float(dedup_threshold if dedup_threshold is not None
+                                     else os.getenv("RAG_DEDUP_THRESHOLD", "0"))
+        # RAG_SHARDS=N splits the vectors across N local worker processes that
+        # are searched in parallel; the rest of the pipeline is unchanged
+        self.shards = int(shards or os.getenv("RAG_SHARDS", "0"))
+        self._reload_lock = threading.Lock()
+        self.state = self._build_state(1)
+
+        if self.boost_table is not None:
+            self.prewarm_answers(self.boost_table.answers)
+
+        # RAG_RELOAD_INTERVAL=N checks the JSON file (or the snapshot manifest)
+        # every N seconds and swaps a rebuilt index in without a restart
+        reload_interval = float(reload_interval if reload_interval is not None
+                                else os.getenv("RAG_RELOAD_INTERVAL", "0"))
+        self.watcher = IndexWatcher(self, reload_interval).start() if reload_interval > 0 else None
+
+    def _build_state(self, version):
+        # The usual build, run on a shallow copy that holds a fresh state, so
+        # the live state is untouched until the caller swaps the new one in
+        builder = copy.copy(self)
+        builder.state = IndexState(version)
+        if self.snapshot_dir:
+            builder.load_snapshot(self.snapshot_dir)
+        else:
+            builder.chunks, builder.metadata = builder.chunk_documents()
+            self.load_report = getattr(builder, "load_report", None)
+            if not builder.chunks:
+                raise ValueError("No chunks available to create embeddings.")
+
+            builder.create_index()
+            self.dedup_report = builder.dedup_report
+        if self.shards > 1:
+            if self.snapshot_dir:
+                builder.index = ShardedIndex(os.path.join(self.snapshot_dir, INDEX_FILE), self.shards)
+            else:
+                builder.index = ShardedIndex.from_index(builder.index, self.shards)
+        return builder.state
+
+    def source_signature(self):
+        return source_signature(self.json_path, self.snapshot_dir)
+
+    def reload(self):
+        # Rebuilds from the same JSON file or snapshot directory next to the
+        # live state, then swaps it in with one assignment. Requests already
+        # running finish on the state they started with; new ones see the new
+        # build. Nothing waits on the rebuild except other reloads.
+        with self._reload_lock:
+            start = time.perf_counter()
+            old = self.state
+            state = self._build_state(old.version + 1)
+            self.state = state
+            # Cache keys carry the version, so this only frees the old entries
+            self.retrieval_cache.clear()
+            self.answer_cache.clear()
+            print(f"Index reloaded as version {state.version} with {state.index.ntotal} vectors "
+                  f"in {time.perf_counter() - start:.1f}s.")
+        if self.boost_table is not None:
+            self.prewarm_answers(self.boost_table.answers)
+        _close_after_grace(old.index)
+        return state
+
+    def stop_watching(self):
+        if self.watcher is not None:
+            self.watcher.close()
+
+    def close(self):
+        # For an instance being dropped (e.g. an evicted corpus): stops the
+        # watcher and, after the grace period, any shard worker processes
+        self.stop_watching()
+        _close_after_grace(self.state.index)
+
+    def save_snapshot(self, snapshot_dir):
+        return save_snapshot(self, snapshot_dir, self.state)
+
+    def load_snapshot(self, snapshot_dir, use_mmap=True):
+        self.index, self.chunks, self.metadata, manifest = load_snapshot(snapshot_dir, use_mmap=use_mmap)
+        self.dimension = manifest["dimension"]
+        if manifest.get("model") not in (None, self.model_name):
+            raise ValueError(f"Snapshot {snapshot_dir} was embedded with {manifest['model']}, not {self.model_name}.")
+        self.cards = load_cards(snapshot_dir, len(self.chunks))
+        self.state.ministries = manifest.get("ministries")  # absent in older snapshots
+        self.sentence_index = load_sentence_index(snapshot_dir, len(self.chunks), use_mmap=use_mmap)
+        if self.index.ntotal == 0:
+            raise ValueError("No chunks available in snapshot.")
+        print(f"FAISS index loaded from snapshot {snapshot_dir} with {self.index.ntotal} vectors.")
 
     def chunk_documents(self):
         chunks = []
         metadata = []
-        try:
-            with open(self.json_path, 'r', encoding='utf-8') as f:  # Specify encoding
-                self.schemes_data = json.load(f)
-        except FileNotFoundError:
+        records = []  # source record number of each chunk
+        # Structured fields per scheme, aligned with chunks, so source panels
+        # and fallback answers are rendered without a generation call
+        self.cards = []
+        self.dedup_report = None
+        if not os.path.exists(self.json_path):
             print(f"Error: JSON file not found at {self.json_path}")
             return [], []
-        except json.JSONDecodeError:
-            print(f"Error: Could not decode JSON from {self.json_path}. Check file format.")
-            return [], []
-        except Exception as e:
-            print(f"An unexpected error occurred loading the JSON: {e}")
-            return [], []
-
-        for scheme in self.schemes_data:
-            data = scheme.get("data", {})
-
-            text_parts = []
-            scheme_name = data.get("scheme_name", "Unknown Scheme")
-            ministry = data.get("ministry", "Unknown Ministry")
-            department = data.get("department", "Unknown Department")
-
-            text_parts.append(f"Scheme: {scheme_name}")
-            text_parts.append(f"Ministry: {ministry}")
-            text_parts.append(f"Department: {department}")
-
-            for key in ["details_content", "eligibility_content", "application_process"]:
-                content = data.get(key, [])
-                if isinstance(content, list):
-                    # Clean up potential None values or non-string items if necessary
-                    cleaned_content = [str(item) for item in content if item is not None]
-                    text_parts.extend(cleaned_content)
-                elif content is not None:  # Handle cases where it might be a single string
-                    text_parts.append(str(content))
-
-            chunk = "\n".join(text_parts).strip()
-            if chunk:
-                chunks.append(chunk)
-                metadata.append({
-                    "scheme_name": scheme_name,
-                    "ministry": ministry,
-                    "department": department
-                })
-
+        # Streamed record by record, so a multi-GB crawl is never held in
+        # memory and a malformed record is skipped and reported, not fatal
+        self.load_report = LoadReport(self.json_path)
+        schemes = iter_schemes(self.json_path, self.load_report)
+
+        with timed("ingest"):
+            for record, scheme in enumerate(schemes):
+                data = scheme.get("data", {})
+
+                text_parts = []
+                scheme_name = data.get("scheme_name", "Unknown Scheme")
+                ministry = data.get("ministry", "Unknown Ministry")
+                department = data.get("department", "Unknown Department")
+
+                text_parts.append(f"Scheme: {scheme_name}")
+                text_parts.append(f"Ministry: {ministry}")
+                text_parts.append(f"Department: {department}")
+
+                for key in ["details_content", "eligibility_content", "application_process"]:
+                    content = data.get(key, [])
+                    if isinstance(content, list):
+                        # Clean up potential None values or non-string items if necessary
+                        cleaned_content = [str(item) for item in content if item is not None]
+                        text_parts.extend(cleaned_content)
+                    elif content is not None:  # Handle cases where it might be a single string
+                        text_parts.append(str(content))
+
+                chunk = "\n".join(text_parts).strip()
+                if chunk:
+                    chunks.append(chunk)
+                    metadata.append({
+                        "scheme_name": scheme_name,
+                        "ministry": ministry,
+                        "department": department
+                    })
+                    self.cards.append(build_card(data))
+                    records.append(record)
+
+        print(self.load_report.summary())
+        for error in self.load_report.errors[:10]:
+            print(f"Warning: skipped record at byte {error['offset']} ({error['reason']}): {error['message']}")
+        if self.load_report.error_count > 10:
+            print(f"Warning: {self.load_report.error_count - 10} more records skipped; run loader.py for the full list.")
+
+        if self.dedup_threshold > 0 and chunks:
+            # MinHash/LSH over the chunk text; only the first record of each
+            # cluster is embedded, the rest become its metadata["variants"]
+            with timed("dedup"):
+                chunks, metadata, self.cards, self.dedup_report = collapse(
+                    chunks, metadata, self.cards, self.dedup_threshold, records)
+            print(dedup_summary(self.dedup_report))
         return chunks, metadata
 
     def create_index(self):
         if not self.chunks:
             print("Skipping index creation as no chunks were loaded.")
             return
-        embeddings = np.array([self.embedding_model.encode(chunk) for chunk in self.chunks]).astype('float32')  # Ensure float32
+        with timed("embed_corpus"):
+            # Batched encode; with an embedding cache only new or edited chunks hit the model
+            if self.embedding_cache is not None:
+                embeddings = self.embedding_cache.encode(
+                    self.chunks, lambda texts: encode_batched(self.embedding_model, texts))
+            else:
+                embeddings = encode_batched(self.embedding_model, self.chunks)
 
         if embeddings.ndim == 1:
             if embeddings.shape[0] > 0:  # Check if the single dimension is not empty
@@ -89,62 +351,345 @@ class GovernmentSchemeRAG:
         else:
             self.dimension = embeddings.shape[1]
 
-        self.index = faiss.IndexFlatL2(self.dimension)
-        self.index.add(embeddings)
+        with timed("index_build"):
+            self.index = faiss.IndexFlatL2(self.dimension)
+            self.index.add(embeddings)
         print(f"FAISS index created successfully with {self.index.ntotal} vectors.")
+        if getattr(self, "dedup_report", None):
+            self.dedup_report["vector_bytes_saved"] = self.dedup_report["collapsed"] * self.dimension * 4
+            print(f"Near-duplicate collapse saved {self.dedup_report['vector_bytes_saved'] / 1e6:.1f} MB of vectors.")
+
+        # Secondary sentence-level index for evidence spans and extractive answers
+        self.sentence_index = None
+        self.get_sentence_index()
+
+    def get_sentence_index(self, state=None):
+        # Built by create_index; rebuilt on first use for older snapshots without one
+        state = state or self.state
+        if state.sentence_index is None:
+            with state.sentence_index_lock:
+                if state.sentence_index is None:
+                    with timed("embed_sentences"):
+                        state.sentence_index = SentenceIndex.build(
+                            state.chunks, lambda texts: self.embedding_model.encode(texts, normalize_embeddings=True),
+                            cache=self.sentence_cache)
+                    print(f"Sentence index built with {len(state.sentence_index)} sentences.")
+        return state.sentence_index
+
+    def ministries(self, state=None):
+        # Ministry filter options; metadata is only scanned once per build
+        state = state or self.state
+        if state.ministries is None:
+            state.ministries = list_ministries(state.metadata)
+        return state.ministries
+
+    def get_card(self, chunk_id, state=None):
+        # Scheme card for a query result id, or None for snapshots without cards
+        state = state or self.state
+        return state.cards[chunk_id] if state.cards is not None else None
+
+    def cards_for(self, results, state=None):
+        state = state or self.state
+        return [self.get_card(r["id"], state) for r in results]
+
+    def render_card(self, chunk_id, state=None, version=None):
+        # None when the id is not from this build: pass the result's "version",
+        # since ids kept from before a reload may point at another scheme
+        state = state or self.state
+        if (version is not None and version != state.version) or not 0 <= chunk_id < len(state.chunks):
+            return None
+        card = self.get_card(chunk_id, state)
+        return render_card(card) if card is not None else state.chunks[chunk_id]
+
+    def encode_query(self, question):
+        # Questions repeat a lot; keep recent embeddings so retrieval and the
+        # extractive scorer share one encode per distinct question
+        embedding = self.query_embeddings.get(question)
+        if embedding is None:
+            with timed("embed_query"):
+                embedding = np.asarray(self.embedding_model.encode(question), dtype='float32').reshape(-1)
+            embedding.flags.writeable = False
+            self.query_embeddings.put(question, embedding)
+        return embedding
 
     def query(self, question, top_k=3):
-        if not self.index or self.index.ntotal == 0:
+        return self._cached_query(self.state, question, top_k)
+
+    def _cached_query(self, state, question, top_k):
+        # Every step of a request uses the one state it started with
+        if not state.index or state.index.ntotal == 0:
             return []  # Return empty if index doesn't exist or is empty
-        question_embedding = self.embedding_model.encode(question).reshape(1, -1).astype('float32')  # Ensure float32
-        distances, indices = self.index.search(question_embedding, top_k)
-
-        results = []
-        for i in indices[0]:
-            # Check index bounds robustly
-            if 0 <= i < len(self.chunks):
-                results.append({
-                    "chunk": self.chunks[i],
-                    "metadata": self.metadata[i]
-                })
+        # Traced around the cache so cache hits reach the query log too
+        with trace("query", top_k=top_k) as current:
+            # Cached results are shared between callers and must be treated as read-only
+            key = (state.version, question, top_k)
+            results = self.retrieval_cache.get(key)
+            if results is None:
+                results = self._query_flight.do(key, self._query, state, question, top_k)
+                self.retrieval_cache.put(key, results)
+            elif current.kind == "query":
+                current.fields["retrieval_cache"] = "hit"
+            _note_results(question, results)
+            return results
+
+    def _query(self, state, question, top_k):
+        question_embedding = self.encode_query(question).reshape(1, -1)
+        return self._retrieve(state, question_embedding, top_k)[0]
+
+    def query_batch(self, questions, top_k=3):
+        return self._query_batch(self.state, questions, top_k)
+
+    def _query_batch(self, state, questions, top_k):
+        if not state.index or state.index.ntotal == 0:
+            return [[] for _ in questions]
+        if not questions:
+            return []
+        # One batched encode and one FAISS search for the whole set of questions
+        with trace("query_batch", batch_size=len(questions), top_k=top_k):
+            with timed("embed_query"):
+                question_embeddings = np.asarray(self.embedding_model.encode(list(questions)), dtype='float32').reshape(len(questions), -1)
+            all_results = self._retrieve(state, question_embeddings, top_k)
+            _note_batch(questions, all_results)
+            return all_results
+
+    def _retrieve(self, state, question_embeddings, top_k):
+        if self.boost_table is None:
+            all_results = self._search(state, question_embeddings, top_k)
+        else:
+            # A few extra candidates so a well-rated scheme just outside top_k can move up
+            all_results = self._search(state, question_embeddings, top_k + BOOST_CANDIDATES)
+            self._apply_boosts(question_embeddings, all_results, top_k)
+        self._add_evidence(state, question_embeddings, all_results)
+        return all_results
+
+    def _apply_boosts(self, question_embeddings, all_results, top_k):
+        # Lower score is better (L2 distance), so a positive boost subtracts
+        with timed("boost"):
+            norms = np.linalg.norm(question_embeddings, axis=1, keepdims=True)
+            unit = question_embeddings / np.where(norms > 0, norms, 1.0)
+            for i, (embedding, results) in enumerate(zip(unit, all_results)):
+                boosts = self.boost_table.lookup(embedding)
+                for r in results:
+                    for key in result_keys(r["metadata"]) if boosts else ():
+                        if key in boosts:
+                            r["boost"] = boosts[key]
+                            break
+                results.sort(key=lambda r: r["score"] - self.boost_weight * r.get("boost", 0.0))
+                all_results[i] = results[:top_k]
+
+    def _search(self, state, question_embeddings, top_k):
+        with timed("faiss_search"):
+            distances, indices = state.index.search(question_embeddings, top_k)
+
+        all_results = []
+        for row_distances, row_indices in zip(distances, indices):
+            results = []
+            for distance, i in zip(row_distances, row_indices):
+                # Check index bounds robustly
+                if 0 <= i < len(state.chunks):
+                    results.append({
+                        "id": int(i),
+                        "score": float(distance),
+                        "chunk": state.chunks[i],
+                        "metadata": state.metadata[i],
+                        "version": state.version
+                    })
+                elif i != -1:  # FAISS pads with -1 when top_k exceeds the index size
+                    print(f"Warning: Index {i} out of bounds for chunks list (length {len(state.chunks)}).")
+            all_results.append(results)
+        return all_results
+
+    def _add_evidence(self, state, question_embeddings, all_results):
+        # Marks the sentences of each result that best match its question, as
+        # character spans into result["chunk"]; no chunk text is re-encoded
+        if state.sentence_index is None:
+            return
+        with timed("evidence"):
+            norms = np.linalg.norm(question_embeddings, axis=1, keepdims=True)
+            unit = question_embeddings / np.where(norms > 0, norms, 1.0)
+            for embedding, results in zip(unit, all_results):
+                spans = state.sentence_index.evidence(embedding, [r["id"] for r in results])
+                for r in results:
+                    r["evidence"] = [{"start": start, "end": end, "score": score, "text": r["chunk"][start:end]}
+                                     for start, end, score in spans[r["id"]]]
+
+    def answer(self, question, top_k=3, ministry=None, priority=0, timeout=None):
+        # Retrieval, optional ministry filter and generation in one call, shared
+        # by the Streamlit UI and the HTTP API
+        with trace("answer", top_k=top_k, ministry=ministry):
+            state = self.state
+            key = _answer_key(state.version, question, top_k, ministry)
+            cached = self.answer_cache.get(key)
+            if cached is not None:
+                ANSWERS_BY_MODE.inc(mode="cached")
+                if current_trace() is not None:
+                    current_trace().fields["mode"] = "cached"
+                _note_results(question, cached["sources"])
+                return dict(cached, question=question)
+
+            results = self._cached_query(state, question, top_k)
+            if ministry and ministry != "All":
+                results = [r for r in results if _in_ministry(r, ministry)]
+            _note_results(question, results)
+            answer = self.answer_extractive(question, results, state) if self.answer_mode != "llm" else None
+            if answer is not None:
+                # An empty result list is not an answer worth caching
+                mode, degraded, generated = "extractive", False, bool(results)
             else:
-                print(f"Warning: Index {i} out of bounds for chunks list (length {len(self.chunks)}).")
-        return results
-
-    def generate_answer(self, question, context):
-        prompt = f"""
-Context about government schemes:
-{context}
-
-Question: {question}
-
-Given the context below about a government scheme, answer the user's question concisely, focusing on the key details requested.
-
-If available, mention:
-- Scheme Name
-- Purpose
-- Eligibility
-- Key Benefits
-- Application Process Overview (briefly)
-- Website Link (if explicitly found in context)
-
-Highlight important section titles in **bold**.
-If information is missing for a section, simply omit that section. Be clear and direct.
-"""
+                context = "\n\n".join([r["chunk"] for r in results])
+                answer, degraded, generated = self._answer_or_degrade(question, context, results, priority, timeout,
+                                                                      state)
+                mode = "llm"
+            ANSWERS_BY_MODE.inc(mode=mode)
+            if current_trace() is not None:
+                current_trace().fields["mode"] = mode
+            response = {
+                "question": question,
+                "answer": answer,
+                "sources": results,
+                "degraded": degraded,
+                "mode": mode
+            }
+            if generated:  # never cache shed requests or backend errors
+                self.answer_cache.put(key, response)
+            return response
+
+    def prewarm_answers(self, entries, top_k=3):
+        # Seeds the answer cache with known-good answers (e.g. the best-rated
+        # answer per feedback cluster); costs one query embedding each.
+        # Traced as warm-up so these lookups stay out of the query log.
+        # An entry listing scheme_keys is skipped unless the current index
+        # still retrieves all of them, so a re-index never serves an answer
+        # written from schemes that moved or changed.
+        seeded = 0
+        with trace("warmup", answers=len(entries)):
+            state = self.state
+            for entry in entries:
+                ministry = entry.get("ministry")
+                results = self._cached_query(state, entry["question"], top_k)
+                if ministry and ministry != "All":
+                    results = [r for r in results if _in_ministry(r, ministry)]
+                if "scheme_keys" in entry:
+                    retrieved = {key for r in results for key in result_keys(r["metadata"])}
+                    if not entry["scheme_keys"] or not retrieved.issuperset(entry["scheme_keys"]):
+                        continue
+                seeded += 1
+                self.answer_cache.put(_answer_key(state.version, entry["question"], top_k, ministry), {
+                    "question": entry["question"], "answer": entry["answer"], "sources": results,
+                    "degraded": False, "mode": "feedback"})
+        if entries:
+            print(f"Answer cache pre-warmed with {seeded} of {len(entries)} answers.")
+
+    def answer_extractive(self, question, results, state=None):
+        # Formatted answer built from the best-matching sentences, or None when
+        # "auto" mode is not confident enough and the LLM should answer instead
+        state = state or self.state
+        extracted = None
+        if results:
+            sentence_index = self.get_sentence_index(state)
+            with timed("extractive"):
+                embedding = self.encode_query(question)
+                embedding = embedding / (np.linalg.norm(embedding) or 1.0)
+                extracted = extract_answer(embedding, results, sentence_index, state.chunks)
+        if extracted is None or not extracted["lines"]:
+            # "extractive" never calls the LLM, so fall back to the scheme list
+            if self.answer_mode != "extractive":
+                return None
+            if not results:  # e.g. the ministry filter removed every result
+                return NO_MATCHES
+            return format_retrieval_only(results, self.cards_for(results, state), intro="Here are the most relevant schemes found:")
+        if self.answer_mode == "auto" and extracted["confidence"] < self.extractive_threshold:
+            return None
+        return format_extractive(extracted)
+
+    def answer_batch(self, questions, top_k=3, ministry=None, max_workers=4, priority=0, timeout=None):
+        with trace("answer_batch", batch_size=len(questions), top_k=top_k, ministry=ministry):
+            state = self.state
+            all_results = self._query_batch(state, questions, top_k)
+            if ministry and ministry != "All":
+                all_results = [[r for r in results if _in_ministry(r, ministry)] for results in all_results]
+            _note_batch(questions, all_results)
+            extractive = [self.answer_extractive(q, results, state) if self.answer_mode != "llm" else None
+                          for q, results in zip(questions, all_results)]
+            # Generation is a remote HTTP call, so overlap the round trips; each
+            # task runs in a copy of this context so its stages join the trace
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(questions)))) as pool:
+                futures = [None if e is not None else
+                           pool.submit(contextvars.copy_context().run, self._answer_or_degrade, q,
+                                       "\n\n".join([r["chunk"] for r in results]), results, priority, timeout, state)
+                           for q, results, e in zip(questions, all_results, extractive)]
+                answers = [(e, False, "extractive") if f is None else f.result()[:2] + ("llm",)
+                           for e, f in zip(extractive, futures)]
+            for _, _, mode in answers:
+                ANSWERS_BY_MODE.inc(mode=mode)
+            return [
+                {"question": q, "answer": a, "sources": results, "degraded": degraded, "mode": mode}
+                for q, (a, degraded, mode), results in zip(questions, answers, all_results)
+            ]
+
+    def generate_answer(self, question, context, sources=None, priority=0, timeout=None):
+        return self._answer_or_degrade(question, context, sources or [], priority, timeout)[0]
+
+    def _answer_or_degrade(self, question, context, sources, priority=0, timeout=None, state=None):
+        # Returns (answer, degraded, generated). When the backend is saturated
+        # the caller gets the retrieved schemes formatted from metadata instead
+        # of an error string; generated is False for that and for error answers
+        deadline = time.monotonic() + timeout if timeout else None
+        try:
+            # Priority is part of the key so a live request never queues behind
+            # a low-priority warm-up call for the same question, and a joiner
+            # stops waiting at its own deadline
+            answer, generated = self._generate_flight.do((question, context, priority), self._generate_answer,
+                                                         question, context, priority, deadline, wait_timeout=timeout)
+            return answer, False, generated
+        except (Overloaded, TimeoutError) as e:
+            print(f"Generation shed: {e}")
+            if current_trace() is not None:
+                current_trace().fields["degraded"] = True
+            return format_retrieval_only(sources, self.cards_for(sources, state)), True, False
+
+    def _generate_answer(self, question, context, priority=0, deadline=None):
+        with timed("prompt_build"):
+            template = choose_template(question, self.prompt_template, self.prompt_ab)
+            prompt = template.render(context=context, question=question)
+        PROMPT_TEMPLATE_USES.inc(template=template.name)
+        if current_trace() is not None:
+            current_trace().fields["prompt_template"] = template.name
         answer = "Could not generate answer using Hugging Face."  # Default error message
+        generated = False
 
         if self.hf_token:
             api_url = "https://api-inference.huggingface.co/models/google/flan-t5-small"
             headers = {"Authorization": f"Bearer {self.hf_token}", "Content-Type": "application/json"}
             payload = {"inputs": prompt, "options": {"wait_for_model": True, "max_length": 450, "temperature": 0.1}}
+            with timed("admission"):
+                self.admission.acquire(self.hf_token, priority=priority, deadline=deadline)
+            # A hung upstream call must not hold this worker past the deadline
+            http_timeout = GENERATION_TIMEOUT
+            if deadline is not None:
+                http_timeout = min(http_timeout, deadline - time.monotonic())
+                if http_timeout <= 0:
+                    raise TimeoutError("Request deadline passed before generation started.")
             try:
-                response = requests.post(api_url, headers=headers, json=payload)
+                with timed("generation_http"):
+                    response = requests.post(api_url, headers=headers, json=payload, timeout=http_timeout)
+                if response.status_code == 429:
+                    # Quota exhausted upstream: back off this key instead of
+                    # rendering the HTTP error as an answer
+                    self.admission.backoff(self.hf_token, _retry_after(response))
+                    raise Overloaded("Hugging Face API rate limit reached (HTTP 429).")
                 response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
                 output = response.json()
                 if output and isinstance(output, list) and 'generated_text' in output[0]:
                     answer = output[0].get("generated_text", "No answer returned by Flan-T5.")
+                    generated = True
                 else:
                     answer = f"Unexpected response format from Flan-T5 API: {output}"
+            except Overloaded:
+                raise
+            except requests.exceptions.Timeout as e:
+                # Answered with the retrieved schemes by _answer_or_degrade
+                raise TimeoutError(f"Hugging Face API did not answer within {http_timeout:.1f}s.") from e
             except requests.exceptions.RequestException as e:
                 print(f"Error calling Hugging Face API: {e}")
                 answer = f"Error: Could not connect to Hugging Face API - {e}"
@@ -154,51 +699,10 @@ If information is missing for a section, simply omit that section. Be clear and
         else:
             answer = "Hugging Face model unavailable (check HUGGINGFACE_TOKEN input)."
 
-        # Apply post-processing
-        answer = answer.replace("Scheme Name:", "**Scheme Name:**")
-        answer = answer.replace("Ministry/Department:", "**Ministry/Department:**")
-        answer = answer.replace("Purpose:", "**Purpose:**")
-        answer = answer.replace("Benefits:", "**Benefits:**")
-        answer = answer.replace("Key Benefits:", "**Key Benefits:**")
-        answer = answer.replace("Eligibility:", "**Eligibility:**")
-        answer = answer.replace("Application Process:", "**Application Process:**")
-        answer = answer.replace("Application Process Overview:", "**Application Process Overview:**")
-        answer = answer.replace("Required Documents:", "**Required Documents:**")
-        answer = answer.replace("Website Link:", "**Website Link:**")
-        answer = answer.replace("Source:", "**Source:**")  # Keep this if your prompt might generate it
-
-        # Make URLs clickable
-        urls = re.findall(r'(https?://[^\s]+)', answer)
-        for url in urls:
-            # Basic check to avoid mangling markdown links if already formatted
-            if f"[{url}]({url})" not in answer and f"**Website Link:** {url}" in answer:
-                answer = answer.replace(url, f"[{url}]({url})")
-
-        # Format application steps (basic newline formatting)
-        if "**Application Process:**" in answer or "**Application Process Overview:**" in answer:
-            lines = answer.split('\n')
-            formatted_lines = []
-            in_app_process = False
-            for line in lines:
-                if line.strip().startswith("**Application Process"):
-                    in_app_process = True
-                    formatted_lines.append(line)
-                elif in_app_process and re.match(r'^\s*\d+\.\s+', line.strip()):
-                    formatted_lines.append(line.strip())  # Keep numbered steps
-                elif in_app_process and line.strip().startswith('- '):
-                    formatted_lines.append(line.strip())  # Keep bullet points
-                elif in_app_process and line.strip() == "":
-                    # Stop adding newlines if the section seems to end
-                    if len(formatted_lines) > 0 and formatted_lines[-1].strip() != "":
-                        in_app_process = False  # Assume end of section on blank line
-                    formatted_lines.append(line)  # Keep blank lines within reason
-                elif in_app_process:
-                    formatted_lines.append(line)  # Keep other lines in the section
-                else:
-                    formatted_lines.append(line)  # Add lines outside the section
-            answer = "\n".join(formatted_lines)
+        with timed("postprocess"):
+            answer = format_answer(answer)
 
-        return answer
+        return answer, generated
 
 
 # # # rag.py
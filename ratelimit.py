@@ -0,0 +1,184 @@
+### Token-bucket rate limiting and admission control for the generation backend
+import heapq
+import itertools
+import os
+import threading
+import time
+
+from metrics import REGISTRY
+
+ADMISSIONS = REGISTRY.counter("rag_admission_total", "Generation admission decisions, by outcome.")
+QUEUE_WAIT_SECONDS = REGISTRY.histogram("rag_admission_wait_seconds", "Time admitted requests waited for a token.")
+
+
+class Overloaded(Exception):
+    # Raised when a generation request is shed instead of being sent upstream
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def available(self, now):
+        self._refill(now)
+        return now >= self.blocked_until and self.tokens >= 1.0
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1.0
+
+    def wait_time(self, now):
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1.0:
+            wait = max(wait, (1.0 - self.tokens) / self.rate if self.rate > 0 else float("inf"))
+        return wait
+
+    def block(self, seconds, now):
+        # Upstream said "slow down": drain the bucket and pause refills
+        self._refill(now)
+        self.tokens = 0.0
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+
+class _Waiter:
+    def __init__(self, key, priority, deadline):
+        self.key = key
+        self.priority = priority
+        self.deadline = deadline
+        self.shed = False
+
+
+class AdmissionController:
+    # Requests take one token from the global bucket and one from their API
+    # key's bucket. Requests that cannot go immediately wait in a bounded queue
+    # ordered by priority (higher first) and deadline. When the queue is full,
+    # the lowest-priority request is shed. A request whose deadline cannot be
+    # met at the current rate is shed straight away rather than queued.
+    def __init__(self, global_rate=5.0, global_burst=10, key_rate=2.0, key_burst=5, max_queue=32,
+                 default_timeout=10.0):
+        self.condition = threading.Condition()
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.key_rate = key_rate
+        self.key_burst = key_burst
+        self.key_buckets = {}
+        self.max_queue = max_queue
+        self.default_timeout = default_timeout
+        self.queue = []  # heap of (-priority, deadline, seq, waiter)
+        self.sequence = itertools.count()
+
+    def _key_bucket(self, key):
+        bucket = self.key_buckets.get(key)
+        if bucket is None:
+            bucket = self.key_buckets[key] = TokenBucket(self.key_rate, self.key_burst)
+        return bucket
+
+    def _can_go(self, waiter, now):
+        return self.global_bucket.available(now) and self._key_bucket(waiter.key).available(now)
+
+    def _next_eligible(self, now):
+        # Highest-priority queued request whose key still has quota
+        for entry in sorted(self.queue):
+            waiter = entry[3]
+            if not waiter.shed and self._key_bucket(waiter.key).available(now):
+                return waiter
+        return None
+
+    def _remove(self, waiter):
+        self.queue = [entry for entry in self.queue if entry[3] is not waiter]
+        heapq.heapify(self.queue)
+
+    def acquire(self, key, priority=0, deadline=None):
+        # Returns the seconds spent waiting; raises Overloaded if shed
+        start = time.monotonic()
+        deadline = deadline if deadline is not None else start + self.default_timeout
+        waiter = _Waiter(key, priority, deadline)
+
+        with self.condition:
+            if not self.queue and self._can_go(waiter, start):
+                self._grant(waiter, start)
+                QUEUE_WAIT_SECONDS.observe(0.0)
+                return 0.0
+
+            expected_wait = (len(self.queue) + 1) / self.global_bucket.rate if self.global_bucket.rate > 0 else float("inf")
+            expected_wait = max(expected_wait, self.global_bucket.wait_time(start))
+            if start + expected_wait > deadline:
+                ADMISSIONS.inc(outcome="shed_deadline")
+                raise Overloaded("Generation backend is saturated; the request would miss its deadline.")
+
+            if len(self.queue) >= self.max_queue:
+                worst = max(self.queue)
+                if (-priority, deadline) >= worst[:2]:
+                    ADMISSIONS.inc(outcome="shed_queue_full")
+                    raise Overloaded("Generation queue is full.")
+                # Make room by shedding the lowest-priority queued request
+                worst[3].shed = True
+                self._remove(worst[3])
+                self.condition.notify_all()
+
+            heapq.heappush(self.queue, (-priority, deadline, next(self.sequence), waiter))
+            while True:
+                now = time.monotonic()
+                if waiter.shed:
+                    ADMISSIONS.inc(outcome="shed_evicted")
+                    raise Overloaded("Request was displaced by higher-priority work.")
+                if now >= waiter.deadline:
+                    self._remove(waiter)
+                    self.condition.notify_all()
+                    ADMISSIONS.inc(outcome="shed_timeout")
+                    raise Overloaded("Timed out waiting for generation capacity.")
+                if self._next_eligible(now) is waiter and self.global_bucket.available(now):
+                    self._remove(waiter)
+                    self._grant(waiter, now)
+                    self.condition.notify_all()
+                    QUEUE_WAIT_SECONDS.observe(now - start)
+                    return now - start
+                wait = max(self.global_bucket.wait_time(now), self._key_bucket(key).wait_time(now), 0.001)
+                self.condition.wait(min(wait, waiter.deadline - now))
+
+    def _grant(self, waiter, now):
+        self.global_bucket.take(now)
+        self._key_bucket(waiter.key).take(now)
+        ADMISSIONS.inc(outcome="admitted")
+
+    def backoff(self, key, seconds):
+        # Called when the backend answers HTTP 429 for this key
+        with self.condition:
+            now = time.monotonic()
+            self._key_bucket(key).block(seconds, now)
+            self.global_bucket.block(seconds / 2, now)
+            ADMISSIONS.inc(outcome="upstream_429")
+
+    def queued(self):
+        with self.condition:
+            return len(self.queue)
+
+
+_default_controller = None
+_default_lock = threading.Lock()
+
+
+def default_admission_controller():
+    # One controller per process so the global quota covers every RAG instance
+    global _default_controller
+    with _default_lock:
+        if _default_controller is None:
+            _default_controller = AdmissionController(
+                global_rate=float(os.getenv("RAG_GEN_RATE", "5")),
+                global_burst=float(os.getenv("RAG_GEN_BURST", "10")),
+                key_rate=float(os.getenv("RAG_GEN_KEY_RATE", "2")),
+                key_burst=float(os.getenv("RAG_GEN_KEY_BURST", "5")),
+                max_queue=int(os.getenv("RAG_GEN_QUEUE", "32")),
+                default_timeout=float(os.getenv("RAG_GEN_TIMEOUT", "10")),
+            )
+        return _default_controller
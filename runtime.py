@@ -0,0 +1,116 @@
+### Per-process thread pools and CPU pinning for torch, FAISS, ONNX Runtime and tokenizers
+import os
+import threading
+
+import faiss
+
+_applied = None
+_lock = threading.Lock()
+_slot_file = None  # held open for the life of the process to keep the claimed slot
+
+
+def parse_cores(spec):
+    # "0-3,8,10-11" -> [0, 1, 2, 3, 8, 10, 11]
+    cores = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            low, high = part.split("-", 1)
+            cores.extend(range(int(low), int(high) + 1))
+        else:
+            cores.append(int(part))
+    return cores
+
+
+def _claim_slot(slots):
+    # Lowest slot no live worker holds: each worker keeps an exclusive lock on
+    # its slot file, and the OS releases it when the worker exits
+    global _slot_file
+    try:
+        import fcntl
+    except ImportError:
+        return os.getpid() % slots
+    lock_dir = os.getenv("RAG_PIN_LOCK_DIR", "/tmp")
+    for slot in range(slots):
+        f = open(os.path.join(lock_dir, f"rag-cpu-slot-{slot}.lock"), "w")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            continue
+        _slot_file = f
+        return slot
+    return os.getpid() % slots
+
+
+def _pin(spec, threads):
+    # "auto" gives each worker its own slice of `threads` cores; anything else
+    # is an explicit core list shared by every worker started with it
+    if not hasattr(os, "sched_setaffinity"):
+        print("Warning: CPU pinning is not supported on this platform.")
+        return None
+    available = sorted(os.sched_getaffinity(0))
+    if spec == "auto":
+        size = threads or 1
+        slots = max(1, len(available) // size)
+        slot = _claim_slot(slots)
+        cores = available[slot * size:(slot + 1) * size]
+    else:
+        cores = [core for core in parse_cores(spec) if core in available]
+    if not cores:
+        print(f"Warning: no usable cores in RAG_PIN_CORES={spec!r}; not pinning.")
+        return None
+    os.sched_setaffinity(0, cores)
+    return cores
+
+
+def configure_threads(threads=None, pin_cores=None):
+    # Applied once per process; later calls return the first configuration.
+    # threads=None leaves every library at its own default.
+    global _applied
+    with _lock:
+        if _applied is not None:
+            return _applied
+        threads = int(threads or os.getenv("RAG_THREADS", "0")) or None
+        pin_cores = pin_cores or os.getenv("RAG_PIN_CORES")
+        cores = _pin(pin_cores, threads) if pin_cores else None
+        if cores:
+            # More threads than pinned cores would only time-slice them
+            threads = min(threads or len(cores), len(cores))
+
+        if threads:
+            # Environment first, for OpenMP/MKL runtimes that have not started yet
+            for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+                os.environ[name] = str(threads)
+            # Each worker already runs its own pool; tokenizers' Rust threads on
+            # top of that only add contention (and deadlock warnings after fork)
+            os.environ["TOKENIZERS_PARALLELISM"] = "false"
+            os.environ.setdefault("RAG_ONNX_THREADS", str(threads))
+            faiss.omp_set_num_threads(threads)
+            try:
+                import torch
+            except ImportError:
+                torch = None
+            if torch is not None:
+                torch.set_num_threads(threads)
+                try:
+                    torch.set_num_interop_threads(1)
+                except RuntimeError:
+                    pass  # only settable before the first parallel op
+
+        _applied = {"threads": threads, "cores": cores, "faiss_threads": faiss.omp_get_max_threads()}
+        if threads or cores:
+            print(f"Thread configuration: {_applied}")
+        return _applied
+
+
+def set_threads(threads):
+    # Re-tunes the library pools in place; used by the benchmark's thread sweep
+    faiss.omp_set_num_threads(threads)
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(threads)
@@ -0,0 +1,190 @@
+### Flat index split across local worker processes and searched scatter-gather
+import atexit
+import itertools
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+
+import faiss
+import numpy as np
+
+from metrics import REGISTRY
+
+SHARD_FAILURES = REGISTRY.counter("rag_shard_failures_total", "Sharded searches that failed, by reason.")
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+def shard_bounds(ntotal, shards):
+    # Contiguous, near-equal ranges: shard i holds global ids bounds[i]:bounds[i + 1]
+    return [ntotal * i // shards for i in range(shards + 1)]
+
+
+def _shard_worker(conn, index_path, start, stop, threads):
+    # Copies its slice out of the memory-mapped index, so the shards together
+    # hold one copy of the vectors and the coordinator holds none
+    faiss.omp_set_num_threads(threads)
+    source = faiss.read_index(index_path, MMAP_FLAGS)
+    index = faiss.IndexFlatL2(source.d)
+    if stop > start:
+        index.add(source.reconstruct_n(start, stop - start))
+    del source
+    conn.send(("ready", index.ntotal))
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        request_id, queries, k = message
+        try:
+            distances, labels = index.search(queries, k)
+            conn.send((request_id, distances, labels, None))
+        except Exception as e:
+            conn.send((request_id, None, None, f"{type(e).__name__}: {e}"))
+    conn.close()
+
+
+class _Gather:
+    def __init__(self, shards):
+        self.results = [None] * shards
+        self.remaining = shards
+        self.done = threading.Event()
+
+
+class ShardedIndex:
+    # Stands in for the faiss.IndexFlatL2 the pipeline searches (d, ntotal,
+    # search). Each query is broadcast to every shard, each shard returns its
+    # own top-k and the coordinator merges them; per-shard reader threads
+    # let concurrent requests pipeline through the workers.
+    def __init__(self, index_path, shards, threads_per_shard=None, timeout=None, cleanup_dir=None):
+        source = faiss.read_index(index_path, MMAP_FLAGS)
+        self.d, self.ntotal = source.d, source.ntotal
+        del source
+        self.index_path = index_path
+        self.cleanup_dir = cleanup_dir
+        self.timeout = float(timeout if timeout is not None else os.getenv("RAG_SHARD_TIMEOUT", "30"))
+        threads = int(threads_per_shard or os.getenv("RAG_SHARD_THREADS", "1"))
+        self.bounds = shard_bounds(self.ntotal, shards)
+        self.failed = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._send_locks = [threading.Lock() for _ in range(shards)]
+
+        # "spawn": forking a process that already runs torch/OpenMP threads can deadlock
+        context = multiprocessing.get_context("spawn")
+        self.processes, self.connections = [], []
+        for i in range(shards):
+            parent, child = context.Pipe()
+            process = context.Process(target=_shard_worker, name=f"rag-shard-{i}", daemon=True,
+                                      args=(child, index_path, self.bounds[i], self.bounds[i + 1], threads))
+            process.start()
+            child.close()
+            self.processes.append(process)
+            self.connections.append(parent)
+        for i, conn in enumerate(self.connections):
+            if not conn.poll(600) or conn.recv()[0] != "ready":
+                self.close()
+                raise RuntimeError(f"Shard worker {i} did not start.")
+        self.readers = [threading.Thread(target=self._read, args=(i,), name=f"rag-shard-reader-{i}", daemon=True)
+                        for i in range(shards)]
+        for reader in self.readers:
+            reader.start()
+        atexit.register(self.close)
+        print(f"Sharded index: {self.ntotal} vectors across {shards} worker processes ({threads} thread(s) each).")
+
+    @classmethod
+    def from_index(cls, index, shards, **kwargs):
+        # For an index built in this process: the workers map a temporary copy
+        directory = tempfile.mkdtemp(prefix="rag-shards-")
+        path = os.path.join(directory, "index.faiss")
+        faiss.write_index(index, path)
+        return cls(path, shards, cleanup_dir=directory, **kwargs)
+
+    def to_faiss(self):
+        # The unsharded index, for snapshots
+        return faiss.read_index(self.index_path)
+
+    def _read(self, shard):
+        conn = self.connections[shard]
+        while True:
+            try:
+                request_id, distances, labels, error = conn.recv()
+            except (EOFError, OSError):
+                self._fail(f"shard {shard} worker exited")
+                return
+            with self._lock:
+                call = self._pending.get(request_id)
+                if call is None:
+                    continue  # the request already timed out
+                call.results[shard] = (distances, labels, error)
+                call.remaining -= 1
+                if call.remaining == 0:
+                    call.done.set()
+
+    def _fail(self, reason):
+        with self._lock:
+            if self.failed is None:
+                self.failed = reason
+            for call in self._pending.values():
+                call.done.set()
+
+    def search(self, queries, k):
+        if self.failed is not None:
+            raise RuntimeError(f"Sharded index unavailable: {self.failed}.")
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        request_id = next(self._ids)
+        call = _Gather(len(self.connections))
+        with self._lock:
+            self._pending[request_id] = call
+        try:
+            for lock, conn in zip(self._send_locks, self.connections):
+                with lock:
+                    conn.send((request_id, queries, k))
+            if not call.done.wait(self.timeout):
+                SHARD_FAILURES.inc(reason="timeout")
+                raise TimeoutError(f"Sharded search timed out after {self.timeout}s.")
+        finally:
+            with self._lock:
+                self._pending.pop(request_id, None)
+        if self.failed is not None:
+            SHARD_FAILURES.inc(reason="worker_exited")
+            raise RuntimeError(f"Sharded index unavailable: {self.failed}.")
+        errors = [result[2] for result in call.results if result[2] is not None]
+        if errors:
+            SHARD_FAILURES.inc(reason="error")
+            raise RuntimeError(f"Shard search failed: {errors[0]}")
+        return self._merge(call.results, k)
+
+    def _merge(self, results, k):
+        # Shard-local labels become global ids; FAISS's -1 padding sorts last
+        distances = np.hstack([result[0] for result in results])
+        labels = np.hstack([np.where(result[1] >= 0, result[1] + start, -1)
+                            for result, start in zip(results, self.bounds)])
+        distances = np.where(labels >= 0, distances, np.inf)
+        order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+        distances = np.take_along_axis(distances, order, axis=1)
+        labels = np.take_along_axis(labels, order, axis=1)
+        distances[labels < 0] = np.finfo(np.float32).max
+        return distances.astype(np.float32), labels.astype(np.int64)
+
+    def close(self):
+        if self.failed is None:
+            self.failed = "closed"
+        for lock, conn in zip(self._send_locks, self.connections):
+            try:
+                with lock:
+                    conn.send(None)
+            except (OSError, ValueError):
+                pass
+        for process in self.processes:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
+        if self.cleanup_dir is not None:
+            shutil.rmtree(self.cleanup_dir, ignore_errors=True)
+            self.cleanup_dir = None
@@ -0,0 +1,56 @@
+### Coalescing of identical in-flight calls
+import threading
+
+from metrics import REGISTRY
+
+COALESCED_CALLS = REGISTRY.counter("rag_coalesced_calls_total", "Calls that waited on an identical in-flight call.")
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    # The first caller for a key runs the function; callers arriving with the
+    # same key while it runs wait and receive the same result (or exception).
+    # Results are shared between callers and must be treated as read-only.
+    # A waiter with wait_timeout gives up after that many seconds with
+    # TimeoutError; the call itself keeps running for the others.
+    def __init__(self, name="default"):
+        self.name = name
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fn, *args, wait_timeout=None, **kwargs):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+
+        if not leader:
+            COALESCED_CALLS.inc(name=self.name)
+            if not call.done.wait(wait_timeout):
+                raise TimeoutError(f"Timed out after {wait_timeout:.1f}s waiting for an identical {self.name} call.")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            # Forget the key before waking waiters so later callers start a fresh call
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result
+
+    def in_flight(self):
+        with self.lock:
+            return len(self.calls)
@@ -0,0 +1,177 @@
+### Index snapshots shared read-only between worker processes
+import json
+import mmap
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+from extractive import SentenceIndex
+
+INDEX_FILE = "index.faiss"
+CHUNKS_FILE = "chunks"
+METADATA_FILE = "metadata"
+CARDS_FILE = "cards"
+SENTENCES_FILE = "sentences"
+MANIFEST_FILE = "manifest.json"
+
+
+def list_ministries(metadata):
+    # Filter options, including the ministries of collapsed near-duplicates
+    return sorted({m.get("ministry", "Unknown") for meta in metadata for m in [meta] + meta.get("variants", [])})
+
+
+class ChunkStore:
+    # Read-only sequence of strings backed by one memory-mapped blob plus an
+    # offsets array, so every worker shares the same page cache copy.
+    def __init__(self, path, decode=None):
+        self.path = path
+        self.decode = decode
+        self.offsets = np.load(f"{path}.idx.npy", mmap_mode="r")
+        self._file = open(f"{path}.bin", "rb")
+        self._blob = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("ChunkStore index out of range")
+        text = self._blob[int(self.offsets[i]):int(self.offsets[i + 1])].decode("utf-8")
+        return self.decode(text) if self.decode else text
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def nbytes(self):
+        return len(self._blob) + self.offsets.nbytes
+
+    def close(self):
+        self._blob.close()
+        self._file.close()
+
+
+def write_store(path, items, encode=None):
+    offsets = [0]
+    with open(f"{path}.bin.tmp", "wb") as f:
+        for item in items:
+            data = (encode(item) if encode else item).encode("utf-8")
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+    with open(f"{path}.idx.npy.tmp", "wb") as f:
+        np.save(f, np.asarray(offsets, dtype=np.int64))
+    os.replace(f"{path}.bin.tmp", f"{path}.bin")
+    os.replace(f"{path}.idx.npy.tmp", f"{path}.idx.npy")
+
+
+def _save_array(path, array):
+    with open(f"{path}.tmp", "wb") as f:
+        np.save(f, array)
+    os.replace(f"{path}.tmp", path)
+
+
+def save_snapshot(rag, snapshot_dir, state=None):
+    # `state` is one consistent build (rag.state); plain objects carry the fields themselves
+    state = state or rag
+    if state.index is None:
+        raise ValueError("Cannot snapshot a RAG system without an index.")
+    os.makedirs(snapshot_dir, exist_ok=True)
+
+    index = state.index.to_faiss() if hasattr(state.index, "to_faiss") else state.index  # sharded
+    faiss.write_index(index, os.path.join(snapshot_dir, INDEX_FILE + ".tmp"))
+    os.replace(os.path.join(snapshot_dir, INDEX_FILE + ".tmp"), os.path.join(snapshot_dir, INDEX_FILE))
+    write_store(os.path.join(snapshot_dir, CHUNKS_FILE), state.chunks)
+    write_store(os.path.join(snapshot_dir, METADATA_FILE), state.metadata, encode=json.dumps)
+    if getattr(state, "cards", None) is not None:
+        write_store(os.path.join(snapshot_dir, CARDS_FILE), state.cards,
+                    encode=lambda card: json.dumps(card, ensure_ascii=False, separators=(",", ":")))
+    sentence_index = getattr(state, "sentence_index", None)
+    if sentence_index is not None:
+        path = os.path.join(snapshot_dir, SENTENCES_FILE)
+        _save_array(f"{path}.npy", sentence_index.embeddings)
+        _save_array(f"{path}.offsets.npy", sentence_index.offsets)
+        _save_array(f"{path}.spans.npy", sentence_index.spans)
+
+    # The manifest is written last so a half-written snapshot is never loaded
+    manifest = {
+        "count": len(state.chunks),
+        "dimension": state.dimension,
+        "model": getattr(rag, "model_name", None),
+        "source": os.path.abspath(rag.json_path) if isinstance(rag.json_path, str) else None,
+        # Saves each serving process decoding every metadata record for the UI filter
+        "ministries": getattr(state, "ministries", None) or list_ministries(state.metadata),
+        "created": time.time(),
+    }
+    with open(os.path.join(snapshot_dir, MANIFEST_FILE + ".tmp"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(os.path.join(snapshot_dir, MANIFEST_FILE + ".tmp"), os.path.join(snapshot_dir, MANIFEST_FILE))
+    print(f"Snapshot with {manifest['count']} chunks written to {snapshot_dir}.")
+    return manifest
+
+
+def load_snapshot(snapshot_dir, use_mmap=True):
+    manifest_path = os.path.join(snapshot_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        raise FileNotFoundError(f"No snapshot manifest found in {snapshot_dir}")
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    index_path = os.path.join(snapshot_dir, INDEX_FILE)
+    if use_mmap:
+        # IndexFlat codes are mapped straight from the file instead of copied
+        # into each process; older FAISS builds only know IO_FLAG_MMAP.
+        flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+        index = faiss.read_index(index_path, flags)
+    else:
+        index = faiss.read_index(index_path)
+
+    chunks = ChunkStore(os.path.join(snapshot_dir, CHUNKS_FILE))
+    metadata = ChunkStore(os.path.join(snapshot_dir, METADATA_FILE), decode=json.loads)
+    if len(chunks) != index.ntotal or len(metadata) != index.ntotal:
+        raise ValueError(f"Snapshot in {snapshot_dir} is inconsistent: "
+                         f"{index.ntotal} vectors, {len(chunks)} chunks, {len(metadata)} metadata entries.")
+    return index, chunks, metadata, manifest
+
+
+def load_cards(snapshot_dir, count):
+    # Snapshots written before scheme cards existed simply have none
+    path = os.path.join(snapshot_dir, CARDS_FILE)
+    if not os.path.exists(f"{path}.idx.npy"):
+        return None
+    cards = ChunkStore(path, decode=json.loads)
+    if len(cards) != count:
+        print(f"Warning: ignoring {len(cards)} scheme cards in {snapshot_dir} for {count} chunks.")
+        cards.close()
+        return None
+    return cards
+
+
+def load_sentence_index(snapshot_dir, count, use_mmap=True):
+    # None for snapshots without one; the caller rebuilds it on demand
+    path = os.path.join(snapshot_dir, SENTENCES_FILE)
+    if not os.path.exists(f"{path}.npy"):
+        return None
+    mmap_mode = "r" if use_mmap else None
+    sentence_index = SentenceIndex(np.load(f"{path}.npy", mmap_mode=mmap_mode),
+                                   np.load(f"{path}.offsets.npy", mmap_mode=mmap_mode),
+                                   np.load(f"{path}.spans.npy", mmap_mode=mmap_mode))
+    if len(sentence_index.offsets) != count + 1:
+        print(f"Warning: ignoring sentence index in {snapshot_dir} built for {len(sentence_index.offsets) - 1} chunks.")
+        return None
+    return sentence_index
+
+
+if __name__ == "__main__":
+    # python snapshot.py scheme_data.json snapshot/
+    if len(sys.argv) != 3:
+        print("Usage: python snapshot.py <scheme_json> <snapshot_dir>")
+        sys.exit(1)
+    from rag import GovernmentSchemeRAG
+    save_snapshot(GovernmentSchemeRAG(sys.argv[1]), sys.argv[2])
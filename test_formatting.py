@@ -0,0 +1,105 @@
+### Equivalence of formatting.format_answer with the post-processing it replaced
+# python -m pytest test_formatting.py
+import random
+import re
+
+from formatting import format_answer
+
+
+def old_format_answer(answer):
+    # The inline post-processing generate_answer used before formatting.py, kept verbatim as the oracle
+    answer = answer.replace("Scheme Name:", "**Scheme Name:**")
+    answer = answer.replace("Ministry/Department:", "**Ministry/Department:**")
+    answer = answer.replace("Purpose:", "**Purpose:**")
+    answer = answer.replace("Benefits:", "**Benefits:**")
+    answer = answer.replace("Key Benefits:", "**Key Benefits:**")
+    answer = answer.replace("Eligibility:", "**Eligibility:**")
+    answer = answer.replace("Application Process:", "**Application Process:**")
+    answer = answer.replace("Application Process Overview:", "**Application Process Overview:**")
+    answer = answer.replace("Required Documents:", "**Required Documents:**")
+    answer = answer.replace("Website Link:", "**Website Link:**")
+    answer = answer.replace("Source:", "**Source:**")
+
+    urls = re.findall(r'(https?://[^\s]+)', answer)
+    for url in urls:
+        if f"[{url}]({url})" not in answer and f"**Website Link:** {url}" in answer:
+            answer = answer.replace(url, f"[{url}]({url})")
+
+    if "**Application Process:**" in answer or "**Application Process Overview:**" in answer:
+        lines = answer.split('\n')
+        formatted_lines = []
+        in_app_process = False
+        for line in lines:
+            if line.strip().startswith("**Application Process"):
+                in_app_process = True
+                formatted_lines.append(line)
+            elif in_app_process and re.match(r'^\s*\d+\.\s+', line.strip()):
+                formatted_lines.append(line.strip())
+            elif in_app_process and line.strip().startswith('- '):
+                formatted_lines.append(line.strip())
+            elif in_app_process and line.strip() == "":
+                if len(formatted_lines) > 0 and formatted_lines[-1].strip() != "":
+                    in_app_process = False
+                formatted_lines.append(line)
+            elif in_app_process:
+                formatted_lines.append(line)
+            else:
+                formatted_lines.append(line)
+        answer = "\n".join(formatted_lines)
+    return answer
+
+
+def check(answer):
+    assert format_answer(answer) == old_format_answer(answer)
+
+
+def test_headers():
+    check("Scheme Name: PM-KISAN\nMinistry/Department: Agriculture\nPurpose: Income support\n"
+          "Key Benefits: Rs 6000\nBenefits: Direct transfer\nEligibility: Farmers\n"
+          "Required Documents: Aadhaar\nSource: myScheme")
+    # "Key Benefits:" renders as "Key **Benefits:**", as it always has
+    assert format_answer("Key Benefits: Rs 6000") == "Key **Benefits:** Rs 6000"
+
+
+def test_links():
+    check("Website Link: https://pmkisan.gov.in\nMore at https://pmkisan.gov.in")
+    check("Website Link: https://a.gov.in/x\nSee https://b.gov.in too")
+    check("Website Link: [https://a.gov.in](https://a.gov.in)")
+    check("No link section, just https://a.gov.in")
+    assert format_answer("Website Link: https://a.gov.in") == \
+        "**Website Link:** [https://a.gov.in](https://a.gov.in)"
+
+
+def test_application_steps():
+    check("Application Process:\n   1. Visit the portal\n  - Upload documents\n2.  Submit\nNote: keep a copy")
+    check("Application Process Overview:\n 1. Register\n\n 2. Not a step any more")
+    check("  1. Before the section\nApplication Process:\n  1. Inside")
+    check("Purpose: x\nApplication Process:\n 1. a\nEligibility: y\nApplication Process:\n   2. b")
+
+
+def test_blank_lines():
+    check("Application Process:\n\n  1. After one blank\n\n\n  2. After three blanks\n - bullet")
+    check("\n\nApplication Process:\n 1. a\n\n\n\n  - b\n")
+    check("Eligibility: x\n\n\nApplication Process:\n\n\n 1. a")
+
+
+def test_url_prefix_differs():
+    # The one documented difference: old replace() also rewrote a linked URL
+    # inside a longer URL it prefixes; format_answer matches whole URLs only
+    answer = "Website Link: https://a.gov.in\nApply at https://a.gov.in/apply"
+    assert old_format_answer(answer).endswith("[https://a.gov.in](https://a.gov.in)/apply")
+    assert format_answer(answer) == \
+        "**Website Link:** [https://a.gov.in](https://a.gov.in)\nApply at https://a.gov.in/apply"
+
+
+def test_random_answers():
+    # Whitespace-delimited URLs, none a prefix or substring of another
+    rng = random.Random(31)
+    urls = ["https://pmkisan.gov.in", "http://b.nic.in/apply", "https://myscheme.gov.in/schemes/c?id=7"]
+    pieces = ["Scheme Name:", "Ministry/Department:", "Purpose:", "Key Benefits:", "Benefits:", "Eligibility:",
+              "Application Process:", "Application Process Overview:", "Required Documents:", "Source:",
+              "Website Link:", "Website Link: " + urls[0], "1. Visit", "  2.  Fill", " - Upload", "-x", "text",
+              "", " ", "  "] + urls + [f"[{urls[1]}]({urls[1]})"]
+    for _ in range(5000):
+        lines = [" ".join(rng.choice(pieces) for _ in range(rng.randint(1, 3))) for _ in range(rng.randint(1, 8))]
+        check("\n".join(lines))
@@ -0,0 +1,96 @@
+### Background cache warm-up with hot questions after the index loads
+import os
+import threading
+import time
+
+from encoders import encode_batched
+from history import HistoryStore
+from metrics import REGISTRY, trace
+
+WARMED = REGISTRY.counter("rag_warmup_total", "Hot questions warmed at startup, by stage and outcome.")
+
+# The UI's "Popular Queries"; also warmed by the API so the first request after a deploy is fast
+EXAMPLE_QUERIES = [
+    "What schemes are available for women entrepreneurs?",
+    "Schemes related to education for girls?",
+    "Financial assistance for farmers?",
+    "Startup schemes in India?",
+]
+
+
+def hot_questions(extra=(), history_db=None, top_n=None, path=None):
+    # Configured list (RAG_WARM_QUERIES, one question per line), the most
+    # asked questions from the history database, then `extra`; de-duplicated
+    top_n = int(top_n if top_n is not None else os.getenv("RAG_WARM_TOP_N", "50"))
+    path = path or os.getenv("RAG_WARM_QUERIES")
+    questions = []
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            questions.extend(line.strip() for line in f if line.strip())
+    history_db = history_db or os.getenv("RAG_HISTORY_DB", "history.sqlite3")
+    if top_n > 0 and os.path.exists(history_db):
+        store = HistoryStore(history_db)
+        questions.extend(store.top_questions(top_n))
+        store.close()
+    questions.extend(extra)
+    return list(dict.fromkeys(questions))
+
+
+def warm(rag, questions, answers=False, answer_rate=0.5, top_k=3, stop=None):
+    # Fills the query-embedding cache with one batched encode, then the
+    # retrieval cache, then optionally the answer cache at answer_rate
+    # generations per second and the lowest priority so live traffic wins
+    stats = {"questions": len(questions), "embedded": 0, "retrieved": 0, "answered": 0, "shed": 0, "failed": 0,
+             "seconds": 0.0}
+    start = time.perf_counter()
+    # One "warmup" trace around everything keeps these requests out of the
+    # stage histograms and the query log; rag_request_seconds has them as kind="warmup"
+    with trace("warmup", questions=len(questions)):
+        todo = [q for q in questions if q not in rag.query_embeddings]
+        if todo:
+            for question, embedding in zip(todo, encode_batched(rag.embedding_model, todo)):
+                embedding.flags.writeable = False
+                rag.query_embeddings.put(question, embedding)
+            stats["embedded"] = len(todo)
+        for question in questions:
+            if stop is not None and stop.is_set():
+                break
+            rag.query(question, top_k=top_k)
+            stats["retrieved"] += 1
+            WARMED.inc(stage="retrieval", outcome="ok")
+
+        if answers:
+            interval = 1.0 / answer_rate if answer_rate > 0 else 0.0
+            for question in questions:
+                if stop is not None and stop.is_set():
+                    break
+                try:
+                    response = rag.answer(question, top_k=top_k, priority=-100)
+                    outcome = "shed" if response["degraded"] else "ok"
+                except Exception as e:
+                    print(f"Warm-up answer failed for {question!r}: {e}")
+                    outcome = "failed"
+                stats["answered" if outcome == "ok" else outcome] += 1
+                WARMED.inc(stage="answer", outcome=outcome)
+                if stop is not None:
+                    stop.wait(interval)
+                else:
+                    time.sleep(interval)
+
+    stats["seconds"] = time.perf_counter() - start
+    rag.warmup_stats = stats
+    print(f"Warm-up done: {stats}")
+    return stats
+
+
+def start_warmer(rag, questions, answers=None, answer_rate=None, top_k=3):
+    # Runs warm() on a daemon thread; returns (thread, stop_event)
+    if answers is None:
+        answers = os.getenv("RAG_WARM_ANSWERS", "").lower() in ("1", "true", "yes")
+    answer_rate = float(answer_rate if answer_rate is not None else os.getenv("RAG_WARM_ANSWER_RATE", "0.5"))
+    stop = threading.Event()
+    rag.warmup_stats = {"questions": len(questions), "running": True}
+    thread = threading.Thread(target=warm, args=(rag, questions), name="rag-warmup", daemon=True,
+                              kwargs={"answers": answers, "answer_rate": answer_rate, "top_k": top_k, "stop": stop})
+    thread.start()
+    return thread, stop